@@ -23,6 +23,7 @@ from dbs_task import *
 
 #-- globals
 DO_PREFIX = re.compile('^do_')
+LOCAL_COMMANDS = ['convert', 'edit', 'init']   # these are never sent to dbsd
 
 #-- helper functions
 def usage():
@@ -39,6 +40,41 @@ def usage():
 
     return
 
+def run_command(argv):
+    params = ''
+    if len(argv) > 1:
+        params = argv[1:]
+    cmd = 'do_' + argv[0]
+
+    if cmd not in globals():
+        print("? no such command: %s" % argv[0])
+        sys.exit(1)
+
+    if cmd != "do_init":
+        do_init(params)
+
+    globals()[cmd](params)
+    return
+
+def run_daemon(argv):
+    # hand the command to dbsd if there is one; False if we have to run
+    # it ourselves
+    if argv[0] in LOCAL_COMMANDS:
+        return False
+
+    termsize = shutil.get_terminal_size()
+    reply = dbsd_request({ 'argv': argv, 'config': dbs_config_name(),
+                           'columns': termsize.columns,
+                           'lines': termsize.lines })
+    if not reply or reply.get('fallback'):
+        return False
+
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    if reply['status']:
+        sys.exit(reply['status'])
+    return True
+
 #-- command functions
 def LA_help():
     return "list ALL tasks in any state"
@@ -57,23 +93,21 @@ def do_LD(params):
     return
 
 def active_help():
-    return "mark one or more tasks active: <name> ..."
+    return "mark one or more tasks active: <name> | <field>=<value> ..."
     
 def do_active(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
 
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        fullpath = task_name_exists(ii)
-        t.set_state(ACTIVE)
-        t.add_note("marked active")
-        put_task(t, overwrite=False)
-        t.print()
-        os.remove(fullpath)
+    batch_begin()
+    try:
+        for t in select_tasks(params, [OPEN]):
+            t.add_note("marked active")
+            t.move(ACTIVE)
+            t.print()
+    finally:
+        batch_end()
     return
 
 def add_help():
@@ -108,71 +142,81 @@ def do_add(params):
 
     return
 
+def convert_help():
+    return "convert the repo to another storage backend: %s" % \
+           ' | '.join(BACKENDS)
+
+def do_convert(params):
+    if len(params) != 1 or params[0] not in BACKENDS:
+        print("? %s" % convert_help())
+        sys.exit(1)
+
+    count = convert_store(params[0])
+    print("%d tasks moved to the %s backend" % (count, params[0]))
+    return
+
 def delete_help():
-    return "delete one or more tasks: <name> ..."
+    return "delete one or more tasks: <name> | <field>=<value> ..."
     
 def do_delete(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
 
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        fullpath = task_name_exists(ii)
-        t.set_state(DELETED)
-        t.add_note("mark deleted")
-        t.move(DELETED)
-        t.print()
-        os.remove(fullpath)
+    batch_begin()
+    try:
+        for t in select_tasks(params, [ACTIVE, OPEN, DONE]):
+            t.add_note("mark deleted")
+            t.move(DELETED)
+            t.print()
+    finally:
+        batch_end()
 
     return
 
 def done_help():
-    return "mark one or more tasks done: <name> ..."
+    return "mark one or more tasks done: <name> | <field>=<value> ..."
     
 def do_done(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
 
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        fullpath = task_name_exists(ii)
-        t.set_state(DONE)
-        t.add_note("marked done")
-        t.move(DONE)
-        t.print()
-        os.remove(fullpath)
+    batch_begin()
+    try:
+        for t in select_tasks(params, [ACTIVE, OPEN]):
+            t.add_note("marked done")
+            t.move(DONE)
+            t.print()
+    finally:
+        batch_end()
 
     return
 
 def down_help():
-    return "lower the priority of a task: <name> ..."
+    return "lower the priority of a task: <name> | <field>=<value> ..."
     
 def do_down(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
     
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        pri = t.get_priority()
-        if pri == 'h':
-            pri = 'm'
-        elif pri == 'm':
-            pri = 'l'
-        else:
-            print("? task \"%s\" already at 'l'" % ii)
-            continue
-        t.set_priority(pri)
-        t.add_note("downed priority")
-        put_task(t)
+    batch_begin()
+    try:
+        for t in select_tasks(params):
+            pri = t.get_priority()
+            if pri == 'h':
+                pri = 'm'
+            elif pri == 'm':
+                pri = 'l'
+            else:
+                print("? task \"%d\" already at 'l'" % int(t.get_name()))
+                continue
+            t.set_priority(pri)
+            t.add_note("downed priority")
+            put_task(t)
+    finally:
+        batch_end()
 
     return
 
@@ -211,18 +255,20 @@ def do_edit(params):
     origtask = get_task(params[0])
     if not origtask:        # the original does not exist
         return
-    fullpath = task_name_exists(params[0])
     tmppath = tempfile.mktemp()
-    shutil.copyfile(fullpath, tmppath)
+    fd = open(tmppath, "w")
+    fd.write(origtask.text())
+    fd.close()
 
     result = editor.edit(filename=tmppath)
     newtask = Task()
     newtask.populate(tmppath, origtask.get_name())
+    newtask.old_notes = origtask.notes      # for the journal
     if newtask.get_state() == origtask.get_state():
         put_task(newtask, overwrite=True)
     else:
-        newtask.write()
-        os.remove(fullpath)
+        newtask.where = origtask.where
+        newtask.move(newtask.get_state())
 
     os.remove(tmppath)
 
@@ -235,24 +281,77 @@ def do_help(params):
     usage()
     return
 
+def history_help():
+    return "list recorded task changes: [<name>] [days=<n>]"
+
+def do_history(params):
+    name = None
+    days = None
+    for ii in params:
+        if ii.startswith('days='):
+            if not ii[5:].isnumeric():
+                print("? need a numeric value for number of days")
+                sys.exit(1)
+            days = int(ii[5:])
+        elif ii.isnumeric():
+            name = task_canonical_name(ii)
+        else:
+            print("? expected -- %s" % history_help())
+            sys.exit(1)
+
+    # a task's whole history, or by default everything in the last day
+    since = None
+    if days is None and name is None:
+        days = 1
+    if days is not None:
+        since = time.time_ns() - days * 24 * 3600 * 1000000000
+
+    records = list(journal_records(since, name))
+    if len(records) < 1:
+        print("No changes found.")
+        return
+
+    for ii in reversed(records):
+        when = time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(ii['t'] / 1e9))
+        old = ii.get('old')
+        new = ii.get('new', {})
+        if new and not old:
+            what = 'added: %s (%s, %s, %s)' % (new['task'], new['project'],
+                                              new['priority'], new['state'])
+        else:
+            what = ', '.join('%s: %s -> %s' % (jj, old[jj], new[jj])
+                             for jj in new)
+        lines = [ what ] if what else []
+        lines.extend('dropped note: %s' % jj for jj in ii.get('dropped', []))
+        lines.extend('note: %s' % jj for jj in ii.get('notes', []))
+        print("%s  %8d  %s" % (when, int(ii['name']), lines[0]))
+        for jj in lines[1:]:
+            print("%s  %s" % (' ' * 29, jj))
+
+    suffix = ''
+    if len(records) > 1:
+        suffix = 's'
+    print("")
+    print("%d change%s found." % (len(records), suffix))
+    return
+
 def inactive_help():
-    return "move one or more tasks from active to open: <name> ..."
+    return "move one or more tasks from active to open: <name> | <field>=<value> ..."
 
 def do_inactive(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
 
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        fullpath = task_name_exists(ii)
-        t.set_state(OPEN)
-        t.add_note("moved from active back to open")
-        put_task(t, overwrite=False)
-        t.print()
-        os.remove(fullpath)
+    batch_begin()
+    try:
+        for t in select_tasks(params, [ACTIVE]):
+            t.add_note("moved from active back to open")
+            t.move(OPEN)
+            t.print()
+    finally:
+        batch_end()
     return
 
 def init_help():
@@ -262,12 +361,12 @@ def do_init(params):
     if not os.path.isfile(dbs_config_name()):
         dbs_defconfig()
     dbs_read_config()
+    dbs_revalidate()            # dbsd may still have the old repo or store
     
     if not os.path.isdir(dbs_repo()):
         dbs_make_repo()
     
-    if not dbs_data_dirs_exist():
-        dbs_make_data_dirs()
+    dbs_store().create()
 
     return
 
@@ -338,13 +437,8 @@ def do_lp(params):
     task_cnt = 0
 
     tasks = {}
-    fullpath = os.path.join(dbs_repo(), ACTIVE)
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	for ii in filenames:
-           t = Task()
-           t.populate(os.path.join(fullpath, ii), ii)
-           if t.get_project() == project:
-               tasks[ii] = t
+    for t in scan_tasks(ACTIVE, project, summary=True):
+        tasks[t.get_name()] = t
 
     if len(tasks) < 1:
         print("No active tasks found for project %s." % project)
@@ -359,13 +453,8 @@ def do_lp(params):
         task_cnt += len(tasks)
 
     tasks = {}
-    fullpath = os.path.join(dbs_repo(), OPEN)
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	for ii in filenames:
-           t = Task()
-           t.populate(os.path.join(fullpath, ii), ii)
-           if t.get_project() == project:
-               tasks[ii] = t
+    for t in scan_tasks(OPEN, project, summary=True):
+        tasks[t.get_name()] = t
 
     if len(tasks) < 1:
         print("No open tasks found for project %s." % project)
@@ -388,7 +477,7 @@ def next_help():
     return "return next unused sequence number (to use as a name)"
 
 def do_next(params):
-    print("Next usable sequence number: %s" % dbs_next())
+    print("Next usable sequence number: %s" % dbs_next(reserve=False))
     return
 
 def note_help():
@@ -400,8 +489,7 @@ def do_note(params):
         print("  got: %s" % ' '.join(params))
         sys.exit(1)
 
-    fullpath = task_name_exists(params[0])
-    if not fullpath:
+    if not task_name_exists(params[0]):
         print("? task \"%s\" is not defined" % params[0])
         sys.exit(1)
 
@@ -418,26 +506,8 @@ def num_help():
     return "print project task counts"
     
 def do_num(params):
-    summaries = {}
-    tasks = {}
-
-    for state in ALLOWED_STATES:
-        if state == DELETED:
-            continue
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	    for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               proj = t.get_project()
-               pri = t.get_priority()
-               state = t.get_state()
-               if proj not in summaries:
-                   summaries[proj] = 0
-               summaries[proj] += 1
-               tasks[ii] = t
-
-    if len(tasks) < 1:
+    summaries = project_summaries([ACTIVE, OPEN, DONE])
+    if len(summaries) < 1:
         print("No projects found.")
         return
 
@@ -445,8 +515,9 @@ def do_num(params):
     print("-Name---  --Total--")
     total = 0
     for ii in sorted(summaries.keys()):
-        total += summaries[ii]
-        print("%s%-8s%s   %5d" % (GREEN_ON, ii, COLOR_OFF, summaries[ii]))
+        count = summaries[ii]['h'] + summaries[ii]['m'] + summaries[ii]['l']
+        total += count
+        print("%s%-8s%s   %5d" % (GREEN_ON, ii, COLOR_OFF, count))
 
     print_projects_found(len(summaries))
     print_tasks_found(total, False)
@@ -456,28 +527,8 @@ def priority_help():
     return "print project task summaries by priority"
     
 def do_priority(params):
-    summaries = {}
-    tasks = {}
-
-    for state in ALLOWED_STATES:
-        if state == DELETED:
-            continue
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	    for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               proj = t.get_project()
-               pri = t.get_priority()
-               state = t.get_state()
-               if proj not in summaries:
-                   summaries[proj] = { 'h':0, 'm':0, 'l':0, \
-                                       ACTIVE:0, OPEN:0, DONE:0 }
-               summaries[proj][pri] += 1
-               summaries[proj][state] += 1
-               tasks[ii] = t
-
-    if len(tasks) < 1:
+    summaries = project_summaries([ACTIVE, OPEN, DONE])
+    if len(summaries) < 1:
         print("No projects and no summaries.")
         return
 
@@ -490,13 +541,7 @@ def do_priority(params):
                summaries[ii]['h'] + summaries[ii]['m'] + summaries[ii]['l']
               ))
 
-    print("")
-    if len(summaries.keys()) > 1:
-        ssuffix = 's'
-    if len(tasks) > 1:
-        tsuffix = 's'
-    print("%d project%s with %d task%s" % (len(summaries.keys()), ssuffix,
-          len(tasks), tsuffix))
+    print_summaries_found(summaries)
 
     return
 
@@ -504,28 +549,8 @@ def projects_help():
     return "print project task summaries"
     
 def do_projects(params):
-    summaries = {}
-    tasks = {}
-
-    for state in ALLOWED_STATES:
-        if state == DELETED:
-            continue
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	    for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               proj = t.get_project()
-               pri = t.get_priority()
-               state = t.get_state()
-               if proj not in summaries:
-                   summaries[proj] = { 'h':0, 'm':0, 'l':0, \
-                                       ACTIVE:0, OPEN:0, DONE:0 }
-               summaries[proj][pri] += 1
-               summaries[proj][state] += 1
-               tasks[ii] = t
-
-    if len(tasks) < 1:
+    summaries = project_summaries([ACTIVE, OPEN, DONE])
+    if len(summaries) < 1:
         print("No projects and no summaries.")
         return
 
@@ -548,14 +573,40 @@ def do_projects(params):
              summaries[ii][ACTIVE] + summaries[ii][OPEN] + summaries[ii][DONE]
             ))
 
-    print("")
-    if len(summaries.keys()) > 1:
-        ssuffix = 's'
-    if len(tasks) > 1:
-        tsuffix = 's'
-    print("%d project%s with %d task%s" % (len(summaries.keys()), ssuffix,
-          len(tasks), tsuffix))
+    print_summaries_found(summaries)
+
+    return
 
+def query_help():
+    return "list tasks matching an expression: <field> <op> <value> " \
+           "[and|or ...]"
+
+def do_query(params):
+    if len(params) < 1:
+        print("? expected -- %s" % query_help())
+        print("  e.g.: dbs query 'state in (open,active) and " \
+              "project=infra and pri>=m and notes>3'")
+        print("  fields: name, state, project, pri, notes, age (days), " \
+              "task (~ for contains)")
+        sys.exit(1)
+
+    # rows come out of the index grouped by state, so print as they come
+    count = 0
+    state = None
+    for t in query_tasks(' '.join(params)):
+        if t.get_state() != state:
+            if state:
+                print("")
+            state = t.get_state()
+            print("%s tasks:" % state.capitalize())
+            one_line_header()
+        t.one_line()
+        count += 1
+
+    if count < 1:
+        print("No tasks found.")
+        return
+    print_tasks_found(count)
     return
 
 def recap_help():
@@ -570,24 +621,13 @@ def do_recap(params):
             print("? need a numeric value for number of days")
             sys.exit(1)
 
-    if days > DAYS_LIMIT:
-        print("? no, you really don't want more than %d days worth." %
-              int(days))
-        sys.exit(1)
-
     current_time = time.time()
     elapsed_time = days * 3600 * 24
+    since = int((current_time - elapsed_time) * 1e9)
 
-    fullpath = os.path.join(dbs_repo(), DONE)
     tasks = {}
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in scan_tasks(DONE, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     if len(tasks) < 1:
         print("No %s tasks found." % DONE)
@@ -603,16 +643,9 @@ def do_recap(params):
                if tasks[ii].get_priority() == pri:
                     tasks[ii].one_line()
 
-    fullpath = os.path.join(dbs_repo(), ACTIVE)
     tasks = {}
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in scan_tasks(ACTIVE, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     print("")
     if len(tasks) < 1:
@@ -629,16 +662,9 @@ def do_recap(params):
                if tasks[ii].get_priority() == pri:
                     tasks[ii].one_line()
 
-    fullpath = os.path.join(dbs_repo(), OPEN)
     tasks = {}
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in scan_tasks(OPEN, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     print("")
     if len(tasks) < 1:
@@ -656,12 +682,41 @@ def do_recap(params):
                     tasks[ii].one_line()
     return
 
+def search_help():
+    return "find tasks by words in their text or notes: <word> ..."
+
+def do_search(params):
+    if len(params) < 1:
+        print("? expected -- %s" % search_help())
+        sys.exit(1)
+
+    found = search_tasks(params)
+    if len(found) < 1:
+        print("No tasks found.")
+        return
+
+    # best matches first, within each state
+    space = False
+    for state in [ACTIVE, OPEN, DONE]:
+        tasks = [ t for t in found if t.get_state() == state ]
+        if len(tasks) < 1:
+            continue
+        if space:
+            print("")
+        print("%s tasks:" % state.capitalize())
+        one_line_header()
+        for t in tasks:
+            t.one_line()
+        space = True
+
+    print_tasks_found(len(found))
+    return
+
 def show_help():
     return "print out a single task: <name>"
     
 def do_show(params):
-    fullpath = task_name_exists(params[0])
-    if not fullpath:
+    if not task_name_exists(params[0]):
         print("? task \"%s\" is not defined" % params[0])
         sys.exit(1)
 
@@ -669,7 +724,7 @@ def do_show(params):
     t.print()
 
     print("")
-    mtime = get_last_modified_time(fullpath)
+    mtime = get_last_modified_time(params[0])
     print("%sLast Modified:%s %s" % (GREEN_ON, COLOR_OFF, mtime))
     return
 
@@ -677,28 +732,8 @@ def state_help():
     return "print project task summaries by state"
     
 def do_state(params):
-    summaries = {}
-    tasks = {}
-
-    for state in ALLOWED_STATES:
-        if state == DELETED:
-            continue
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	    for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               proj = t.get_project()
-               pri = t.get_priority()
-               state = t.get_state()
-               if proj not in summaries:
-                   summaries[proj] = { 'h':0, 'm':0, 'l':0, \
-                                       ACTIVE:0, OPEN:0, DONE:0 }
-               summaries[proj][pri] += 1
-               summaries[proj][state] += 1
-               tasks[ii] = t
-
-    if len(tasks) < 1:
+    summaries = project_summaries([ACTIVE, OPEN, DONE])
+    if len(summaries) < 1:
         print("No projects and no summaries.")
         return
 
@@ -712,13 +747,7 @@ def do_state(params):
              summaries[ii][ACTIVE] + summaries[ii][OPEN] + summaries[ii][DONE]
             ))
 
-    print("")
-    if len(summaries.keys()) > 1:
-        ssuffix = 's'
-    if len(tasks) > 1:
-        tsuffix = 's'
-    print("%d project%s with %d task%s" % (len(summaries.keys()), ssuffix,
-          len(tasks), tsuffix))
+    print_summaries_found(summaries)
 
     return
 
@@ -726,28 +755,8 @@ def todo_help():
     return "print info for only projects with open tasks"
     
 def do_todo(params):
-    summaries = {}
-    tasks = {}
-
-    for state in ALLOWED_STATES:
-        if state == DELETED or state == DONE:
-            continue
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-    	    for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               proj = t.get_project()
-               pri = t.get_priority()
-               state = t.get_state()
-               if proj not in summaries:
-                   summaries[proj] = { 'h':0, 'm':0, 'l':0, \
-                                       ACTIVE:0, OPEN:0, DONE:0 }
-               summaries[proj][pri] += 1
-               summaries[proj][state] += 1
-               tasks[ii] = t
-
-    if len(tasks) < 1:
+    summaries = project_summaries([ACTIVE, OPEN])
+    if len(summaries) < 1:
         print("No projects and no summaries.")
         return
 
@@ -760,39 +769,34 @@ def do_todo(params):
              summaries[ii][ACTIVE] + summaries[ii][OPEN]
             ))
 
-    print("")
-    if len(summaries.keys()) > 1:
-        ssuffix = 's'
-    if len(tasks) > 1:
-        tsuffix = 's'
-    print("%d project%s with %d task%s" % (len(summaries.keys()), ssuffix,
-          len(tasks), tsuffix))
+    print_summaries_found(summaries)
 
     return
 
 def up_help():
-    return "raise the priority of a task: <name> ..."
+    return "raise the priority of a task: <name> | <field>=<value> ..."
     
 def do_up(params):
     if len(params) < 1:
         print("? must provide at least one task name")
         sys.exit(1)
     
-    for ii in params:
-        t = get_task(ii)
-        if not t:
-            continue
-        pri = t.get_priority()
-        if pri == 'l':
-            pri = 'm'
-        elif pri == 'm':
-            pri = 'h'
-        else:
-            print("? task \"%s\" already at 'h'" % ii)
-            continue
-        t.set_priority(pri)
-        t.add_note("upped priority")
-        put_task(t)
+    batch_begin()
+    try:
+        for t in select_tasks(params):
+            pri = t.get_priority()
+            if pri == 'l':
+                pri = 'm'
+            elif pri == 'm':
+                pri = 'h'
+            else:
+                print("? task \"%d\" already at 'h'" % int(t.get_name()))
+                continue
+            t.set_priority(pri)
+            t.add_note("upped priority")
+            put_task(t)
+    finally:
+        batch_end()
 
     return
 
@@ -809,19 +813,7 @@ def dbs():
     if len(sys.argv) < 2:
         usage()
         sys.exit(0)
-    else:
-        params = ''
-        if len(sys.argv) > 2:
-            params = sys.argv[2:]
-        cmd = 'do_' + sys.argv[1]
-
-        if cmd not in globals():
-            print("? no such command: %s" % sys.argv[1])
-            sys.exit(1)
-
-        if cmd != "do_init":
-            do_init(params)
-
-        globals()[cmd](params)
+    elif not run_daemon(sys.argv[1:]):
+        run_command(sys.argv[1:])
 
     return
@@ -7,18 +7,28 @@
 #
 
 import collections
+import ctypes
+import ctypes.util
 import curses
 from curses import panel
 import datetime
 import editor
+import fcntl
+import gc
+import json
+import marshal
+import mmap
 import os
 import os.path
-import pathlib
 import re
 import shutil
+import socket
+import sqlite3
+import struct
 import sys
 import tempfile
 import time
+import zlib
 
 #-- globals
 VERSION = "0.6.2"
@@ -27,24 +37,85 @@ AUTHOR = "Al Stone <ahs3@ahs3.net>"
 CONFIG = "config"
 CONFIG_VALUES = {}
 REPO = "repo"
+FSYNC = "fsync"
+ALWAYS = "always"
+NEVER = "never"
+BACKEND = "repo_backend"
+FILES = "files"
+SQLITE = "sqlite"
+LOG = "log"
+BACKENDS = [FILES, SQLITE, LOG]
 ACTIVE = "active"
 OPEN = "open"
 DONE = "done"
 DELETED = "deleted"
 ALLOWED_STATES = [ACTIVE, OPEN, DONE, DELETED]
-DAYS_LIMIT = 60
+SELECT_FIELDS = ['project', 'state', 'priority']
 LASTNUM = "lastnum"
-
-#-- task fields
-RE_NAME = re.compile('^Name:')
-RE_TASK = re.compile('^Task:')
-RE_STATE = re.compile('^State:')
-RE_PROJECT = re.compile('^Project:')
-RE_PRIORITY = re.compile('^Priority:')
-RE_NOTE = re.compile('^Note:')
+INDEX = "index.db"
+INDEX_DB = None
+INDEX_VERSION = 5
+CACHE = "tasks.db"
+CACHE_DB = None
+CACHE_MAX = 250000
+CACHE_VERSION = 2
+BATCH = None
+STORE = None
+STORE_DB = "store.db"
+STORE_VERSION = 1
+LOG_DIR = "log"
+LOG_SUFFIX = ".seg"
+LOG_INDEX = "index"
+LOG_LOCK = "lock"
+LOG_VERSION = 1
+LOG_COLUMNS = 9                 # seg, off, size, mtime, state, task, project,
+                                # priority, nnotes
+LOG_MAGIC = b'dbs1'
+LOG_HEADER = struct.Struct('<4sIIQ')    # magic, length, crc32, mtime
+LOG_SEGMENT = 8 * 1024 * 1024   # bytes in a segment before starting another
+LOG_INDEX_SLACK = 1024 * 1024   # bytes read in before the index is saved
+JOURNAL = "journal"
+JOURNAL_BLOCK = 65536           # bytes read at a time, from the end
+JOURNAL_FIELDS = ['task', 'state', 'project', 'priority']
+TASK_FIELDS = [(b'Task', ''), (b'State', 'open'), (b'Project', ''),
+               (b'Priority', 'm')]      # and their values in a new Task
+READ_SIZE = 65536               # bytes read at a time from a task file
+SNAPSHOT = "snapshot"
+SNAPSHOT_VERSION = 2
+DBSD_SOCKET = "dbsd.sock"
+DBSD_TIMEOUT = 1                # seconds to wait on dbsd before going without
+WATCH_POLL = 2                  # seconds between looks, without inotify
+
+#-- inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_EVENT = struct.Struct('iIII')
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+          IN_DELETE
+
+#-- a line of a task, as bytes: the field (b'' if it is not one) and the
+#-- rest of the line, after any space str.strip() would take off
+RE_LINE = re.compile(rb'^[ \t\v\f\x1c-\x1f]*'
+                     rb'(?:(Name|Task|State|Project|Priority|Note):)?(.*)', re.M)
+
+#-- the same grammar, for a summary: only the lines of the fields in one,
+#-- and each note as (b'', b''), so that notes are counted without their
+#-- text being copied out
+RE_SUMMARY = re.compile(rb'^[ \t\v\f\x1c-\x1f]*'
+                        rb'(?:(Task|State|Project|Priority):(.*)|Note:)', re.M)
 
 #-- config field
 RE_REPO = re.compile('^repo:')
+RE_FSYNC = re.compile('^fsync:')
+RE_BACKEND = re.compile('^repo_backend:')
+
+#-- query tokens: punctuation, 'quoted', "quoted" or a bare word
+RE_QUERY = re.compile(r'''\s*(?:(\(|\)|,|!=|<=|>=|=|<|>|~)|'([^']*)'|"([^"]*)"|([^\s(),!=<>~'"]+))''')
 
 HIGH = 'h'
 MEDIUM = 'm'
@@ -64,90 +135,67 @@ class Task:
         self.priority = "m"
         self.state = "open"
         self.notes = []
+        self.nnotes = None
+        self.where = None           # the state the store keeps it under
+        self.saved = None
+        self.old_notes = None       # the notes before they were replaced
 
     def __lt__(self, other):
         return int(self.name) < int(other.name)
 
+    def __getattr__(self, name):
+        # only called for a missing attribute: tasks made by lazy_task()
+        # have a note count but no notes until they are needed, and then
+        # read them from the store
+        if name != 'notes' or not self.__dict__.get('where'):
+            raise AttributeError(name)
+        self.notes = []
+        self.nnotes = None
+        dbs_store().fill(self)
+        return self.notes
+
     def validate(self, info):
         # info needs to be an array of lines
-        ret = ''
-        linenum = 0
-        for ii in info:
-            line = ii.strip()
-            k = line.split(':')[0]
-            v = ' '.join(line.split(':')[1:]).strip()
-            linenum += 1
-            if RE_NAME.search(line) or RE_NOTE.search(line):
-                continue
-            elif RE_TASK.search(line):
-                if len(v) > 0:
-                    continue
-                else:
-                    ret = '? no task description at line %d' % (linenum)
-            elif RE_PROJECT.search(line):
-                if len(v) > 0:
-                    continue
-                else:
-                    ret = '? no project name at line %d' % (linenum)
-            elif RE_STATE.search(line):
-                if v in ALLOWED_STATES:
-                    continue
-                else:
-                    ret = '? unknown state "%s" at line %d' % (k, linenum)
-            elif RE_PRIORITY.search(line):
-                if v in [HIGH, MEDIUM, LOW]:
-                    continue
-                else:
-                    ret = '? unknown priority "%s" at line %d' % (k, linenum)
-            else:
-                ret = '? unknown keyword "%s" at line %d' % (k, linenum)
-                break
-        return ret
+        data = ''.join(ii if ii.endswith('\n') else ii + '\n' for ii in info)
+        return task_errors(data.encode())
 
     def set_fields(self, info):
-        # info needs to be an array of lines
-        ret = ''
-        linenum = 0
-
-        self.notes.clear()
-        for ii in info:
-            line = ii.strip()
-            d = ' '.join(line.split(':')[1:])
-            if RE_NAME.search(line):
-                 num = line.replace('Name:','').strip()
-                 self.name = task_canonical_name(num)
-            elif RE_TASK.search(line):
-                 self.task = line.replace('Task:','').strip()
-            elif RE_STATE.search(line):
-                 self.state = line.replace('State:','').strip()
-            elif RE_PROJECT.search(line):
-                 self.project = line.replace('Project:','').strip()
-            elif RE_PRIORITY.search(line):
-                 self.priority = line.replace('Priority:','').strip()
-            elif RE_NOTE.search(line):
-                 self.notes.append(line.replace('Note:','').strip())
+        # info needs to be an array of lines; read with the same grammar
+        # as parse(), but only the fields given change (and the name, too)
+        data = ''.join(ii if ii.endswith('\n') else ii + '\n' for ii in info)
+
+        # the notes may have been edited too, so rewrite it all next time
+        # and let the journal see what they were
+        self.saved = None
+        if self.old_notes is None:
+            self.old_notes = self.notes
+        self.notes = []
+        for (key, value) in task_lines(data.encode(), 0, None):
+            if key == b'Name':
+                 self.name = task_canonical_name(field_value(key, value))
+            elif key == b'Task':
+                 self.task = field_value(key, value)
+            elif key == b'State':
+                 self.state = field_value(key, value)
+            elif key == b'Project':
+                 self.project = field_value(key, value)
+            elif key == b'Priority':
+                 self.priority = field_value(key, value)
+            elif key == b'Note':
+                 self.notes.append(field_value(key, value))
         return
 
     def populate(self, fname, name):
-        fd = open(fname, "r")
-        info = fd.readlines()
-        #print(info)
-        fd.close()
+        self.parse(read_file(fname), name)
+        return
 
+    def parse(self, data, name, pos=0, endpos=None):
+        # data is the task as bytes: a whole file, or part of a segment
+        # of the log
         self.name = task_canonical_name(name)
-        for ii in info:
-            line = ii.strip()
-            d = ' '.join(line.split(':')[1:])
-            if RE_TASK.search(line):
-                 self.task = line.replace('Task:','').strip()
-            elif RE_STATE.search(line):
-                 self.state = line.replace('State:','').strip()
-            elif RE_PROJECT.search(line):
-                 self.project = line.replace('Project:','').strip()
-            elif RE_PRIORITY.search(line):
-                 self.priority = line.replace('Priority:','').strip()
-            elif RE_NOTE.search(line):
-                 self.notes.append(line.replace('Note:','').strip())
+        (self.task, self.state, self.project, self.priority, self.notes) = \
+            task_fields(data, pos, endpos)
+        self.saved = (self.header(), len(self.notes))
         return
 
     def set_name(self, name):
@@ -192,13 +240,19 @@ class Task:
     def get_notes(self):
         return self.notes
 
+    def header(self):
+        return (self.task, self.state, self.project, self.priority)
+
     def note_count(self):
+        # tasks read from the index carry a note count, but no notes
+        if self.nnotes is not None:
+            return self.nnotes
         return len(self.notes)
 
     def dump(self):
         # for debug use
-        print("--- file name: %s" % 
-              os.path.join(dbs_repo(), self.state, self.name))
+        print("--- file name: %s" %
+              dbs_store().location(self.name, self.state))
         print("Task: %s" % self.task)
         print("State: %s" % self.state)
         print("Project: %s" % self.project)
@@ -209,8 +263,11 @@ class Task:
         return
 
     def show_text(self):
-        text = "Name: %s\n" % self.name
-        text += "Task: %s\n" % self.task
+        return "Name: %s\n" % self.name + self.text()
+
+    def text(self):
+        # the task as populate() reads it
+        text = "Task: %s\n" % self.task
         text += "State: %s\n" % self.state
         text += "Project: %s\n" % self.project
         text += "Priority: %s\n" % self.priority
@@ -221,7 +278,7 @@ class Task:
 
     def print(self):
         print("%s--- file:%s %s" % (GREEN_ON, COLOR_OFF,
-              os.path.join(dbs_repo(), self.state, self.name)))
+              dbs_store().location(self.name, self.state)))
         print("    %sTask:%s %s" % (GREEN_ON, COLOR_OFF, self.task))
         print("   %sState:%s %s" % (GREEN_ON, COLOR_OFF, self.state))
         print(" %sProject:%s %s" % (GREEN_ON, COLOR_OFF, self.project))
@@ -239,7 +296,7 @@ class Task:
         else:
             color = ''
 
-        note_cnt = len(self.notes)
+        note_cnt = self.note_count()
         nnotes = ''
         if note_cnt > 0:
             nnotes = " [%d]" % note_cnt
@@ -248,42 +305,1998 @@ class Task:
         return
 
     def write(self, overwrite=False):
-        fname = os.path.join(dbs_repo(), self.state, self.name)
-        if not overwrite and os.path.isfile(fname):
-            print("? task %s already exists" % self.name)
-            sys.exit(1)
+        dbs_store().put(self, overwrite)
+        return
+
+    def move(self, new_state):
+        dbs_store().move(self, new_state)
+        return
+
+class TaskIndex:
+    # The index is a small sqlite database kept in the repo that holds
+    # the one-line summary of every task, so that listings do not need
+    # to open and parse every task file.  The store's stamp for each state
+    # (for FileStore, the directory mtime) is recorded as well; if a state
+    # changes behind our back (another machine, an editor, a plain 'mv'),
+    # only that state is rescanned, and only the tasks whose mtime changed
+    # get parsed again.
+    #
+    # The meta table tells snapshots (see snapshot_read()) whether the
+    # index is the one they were taken against, and whether it has had
+    # to rescan anything since.
+    #
+    # Triggers on the tasks table keep a project x state x priority count
+    # cube up to date, so the summaries never have to look at every task;
+    # an index on the same three columns serves 'dbs query', and one on
+    # (state, mtime) finds the tasks changed since some time (recaps)
+    # without looking at the others.
+    #
+    # The task text and notes of every task are also in an FTS5 table,
+    # with the task number as rowid, for 'dbs search' and the UI.
+    def __init__(self, path):
+        self.path = path
+        self.names = None
+        try:
+            self.open()
+        except sqlite3.DatabaseError:
+            # the index is only a cache; start over if it is damaged
+            self.db.close()
+            os.remove(self.path)
+            self.open()
+        self.refresh()
+        return
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.inode = os.stat(self.path).st_ino
+        self.changes = None
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            self.db.executescript('''
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS tasks;
+                DROP TABLE IF EXISTS counts;
+                DROP TABLE IF EXISTS search;
+                DROP TABLE IF EXISTS meta;
+                ''')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                state TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                project TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                notes INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state
+                ON tasks (state, project, priority);
+            CREATE INDEX IF NOT EXISTS tasks_mtime ON tasks (state, mtime);
+            CREATE INDEX IF NOT EXISTS tasks_version
+                ON tasks (state, name, mtime, size);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS counts (
+                project TEXT NOT NULL,
+                state TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (project, state, priority)
+            );
+            -- no upserts in here: ON CONFLICT with no target needs
+            -- sqlite 3.35, and INSERT OR IGNORE would take on the upsert
+            -- of the statement firing the trigger instead
+            CREATE TRIGGER IF NOT EXISTS count_insert AFTER INSERT ON tasks
+            BEGIN
+                INSERT INTO counts
+                    SELECT new.project, new.state, new.priority, 0
+                    WHERE NOT EXISTS (SELECT 1 FROM counts
+                        WHERE project = new.project AND state = new.state
+                          AND priority = new.priority);
+                UPDATE counts SET count = count + 1
+                    WHERE project = new.project AND state = new.state
+                      AND priority = new.priority;
+            END;
+            CREATE TRIGGER IF NOT EXISTS count_delete AFTER DELETE ON tasks
+            BEGIN
+                UPDATE counts SET count = count - 1
+                    WHERE project = old.project AND state = old.state
+                      AND priority = old.priority;
+            END;
+            CREATE TRIGGER IF NOT EXISTS count_update
+                AFTER UPDATE OF project, state, priority ON tasks
+            BEGIN
+                UPDATE counts SET count = count - 1
+                    WHERE project = old.project AND state = old.state
+                      AND priority = old.priority;
+                INSERT INTO counts
+                    SELECT new.project, new.state, new.priority, 0
+                    WHERE NOT EXISTS (SELECT 1 FROM counts
+                        WHERE project = new.project AND state = new.state
+                          AND priority = new.priority);
+                UPDATE counts SET count = count + 1
+                    WHERE project = new.project AND state = new.state
+                      AND priority = new.priority;
+            END;
+            PRAGMA user_version = %d;
+            ''' % INDEX_VERSION)
+        if len(self.generation()) < 2:
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO meta "
+                                "VALUES ('epoch', abs(random()))")
+                self.db.execute("INSERT OR IGNORE INTO meta "
+                                "VALUES ('resyncs', 0)")
+
+        # not every sqlite has FTS5; everything but searching works without
+        self.searchable = True
+        try:
+            self.db.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+                    name UNINDEXED, task, notes, prefix = '2 3'
+                );
+                CREATE TRIGGER IF NOT EXISTS search_delete
+                    AFTER DELETE ON tasks
+                BEGIN
+                    DELETE FROM search WHERE rowid = CAST(old.name AS INTEGER);
+                END;
+                ''')
+        except sqlite3.OperationalError:
+            self.searchable = False
+        return
+
+    def refresh(self):
+        # catch up with the states changed behind our back; where a task
+        # can change without its state's stamp changing (a file edited in
+        # place), every task has to be looked at
+        known = dict(self.db.execute('SELECT state, mtime FROM dirs'))
+        store = dbs_store()
+        for state in ALLOWED_STATES:
+            mtime = store.stamp(state)
+            if mtime is None:
+                continue
+            if known.get(state) != mtime or store.in_place:
+                self.resync(state, mtime, known.get(state))
+        return
+
+    def revalidate(self):
+        # for long running processes: if anybody else has written to the
+        # index since we last looked, the name map may be out of date
+        changes = self.db.execute('PRAGMA data_version').fetchone()[0]
+        if changes != self.changes:
+            self.names = None
+            self.changes = changes
+        self.refresh()
+        return
+
+    def resync(self, state, mtime, before):
+        # the tasks of one state the store has other than we do, by their
+        # (mtime, size); the resync only counts if there were any
+        known = { name:(tmtime, size) for (name, tmtime, size) in
+                  self.db.execute('SELECT name, mtime, size FROM tasks '
+                                  'WHERE state = ?', (state,)) }
+        changed = list(dbs_store().changed(state, known))
+        if not changed and not known and before == mtime:
+            return
+        with self.db:
+            for (task, tmtime, size) in changed:
+                self.put(task, state, tmtime, size)
+            for ii in known:
+                self.db.execute('DELETE FROM tasks WHERE name = ? AND state = ?',
+                                (ii, state))
+                if self.names and self.names.get(ii) == state:
+                    del self.names[ii]
+            self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)',
+                            (state, mtime))
+            self.db.execute("UPDATE meta SET value = value + 1 "
+                            "WHERE key = 'resyncs'")
+        return
+
+    def put(self, task, state, mtime, size):
+        # an upsert rather than INSERT OR REPLACE, so the update trigger
+        # fires and the counts stay right
+        self.db.execute('INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (name) DO UPDATE SET '
+                        'state = excluded.state, '
+                        'project = excluded.project, '
+                        'priority = excluded.priority, '
+                        'notes = excluded.notes, '
+                        'mtime = excluded.mtime, '
+                        'task = excluded.task, '
+                        'size = excluded.size',
+                        (task.get_name(), state, task.get_project(),
+                         task.get_priority(), task.note_count(), mtime,
+                         task.get_task(), size))
+        if self.searchable:
+            self.db.execute('INSERT OR REPLACE INTO search (rowid, name, '
+                            'task, notes) VALUES (?, ?, ?, ?)',
+                            (int(task.get_name()), task.get_name(),
+                             task.get_task(), '\n'.join(task.get_notes())))
+        if self.names is not None:
+            self.names[task.get_name()] = state
+        return
+
+    def update(self, written, befores):
+        # record tasks we just wrote, as (task, state, mtime, size); each
+        # state touched is only marked as up to date if nobody else changed
+        # it meanwhile
+        with self.db:
+            for (task, state, mtime, size) in written:
+                self.put(task, state, mtime, size)
+            for ii in befores:
+                after = dbs_store().stamp(ii)
+                if after == befores[ii]:
+                    continue
+                if befores[ii] is None:
+                    # a state the store had nothing in until now (see
+                    # LogStore.stamp()) has no row yet to move along
+                    self.db.execute('INSERT OR IGNORE INTO dirs '
+                                    'VALUES (?, ?)', (ii, after))
+                else:
+                    self.db.execute('UPDATE dirs SET mtime = ? '
+                                    'WHERE state = ? AND mtime = ?',
+                                    (after, ii, befores[ii]))
+        return
+
+    def generation(self):
+        # (epoch, resyncs): which index this is, and how many times it
+        # had to catch up with changes made behind its back
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        return tuple(meta[ii] for ii in ['epoch', 'resyncs'] if ii in meta)
+
+    def projects(self, state):
+        # name -> (project, mtime) for every task in one state
+        rows = self.db.execute('SELECT name, project, mtime FROM tasks '
+                               'WHERE state = ?', (state,))
+        return { name:(project, mtime) for (name, project, mtime) in rows }
+
+    def lookup(self, name):
+        # name -> state map, built once per process and kept current by put()
+        if self.names is None:
+            self.names = dict(self.db.execute('SELECT name, state FROM tasks'))
+        return self.names.get(name)
+
+    def fields(self, name):
+        # (field -> value, note count) for a task, as last written
+        row = self.db.execute('SELECT task, state, project, priority, notes '
+                              'FROM tasks WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return (dict(zip(JOURNAL_FIELDS, row[:4])), row[4])
+
+    def summaries(self, states):
+        # project -> task counts by priority and by state
+        summaries = {}
+        query = 'SELECT project, state, priority, count FROM counts ' \
+                'WHERE count > 0 AND state IN (%s)' % \
+                ','.join('?' * len(states))
+        for (project, state, priority, count) in \
+            self.db.execute(query, states):
+            if project not in summaries:
+                summaries[project] = { HIGH:0, MEDIUM:0, LOW:0,
+                                       ACTIVE:0, OPEN:0, DONE:0, DELETED:0 }
+            summaries[project][priority] += count
+            summaries[project][state] += count
+        return summaries
+
+    def search(self, terms, states):
+        # tasks whose text or notes have words starting with every one
+        # of the terms, best matches first; a match in the task text
+        # counts for more than one in the notes
+        query = ' '.join('"%s"*' % ii.replace('"', '""') for ii in terms)
+        rows = self.db.execute(
+                    'SELECT tasks.name, tasks.state, tasks.project, '
+                    'tasks.priority, tasks.notes, tasks.task '
+                    'FROM search JOIN tasks ON tasks.name = search.name '
+                    'WHERE search MATCH ? AND tasks.state IN (%s) '
+                    'ORDER BY bm25(search, 0.0, 4.0, 1.0), tasks.name' %
+                    ','.join('?' * len(states)), [query] + states)
+        for row in rows:
+            t = Task()
+            (t.name, t.state, t.project, t.priority, t.nnotes, t.task) = row
+            t.where = t.state
+            yield t
+        return
+
+    def tasks(self, state, project=None, since=None):
+        query = 'SELECT name, state, project, priority, notes, task ' \
+                'FROM tasks WHERE state = ?'
+        args = [state]
+        if project is not None:
+            query += ' AND project = ?'
+            args.append(project)
+        if since is not None:
+            query += ' AND mtime > ?'
+            args.append(since)
+        for row in self.db.execute(query, args):
+            t = Task()
+            (t.name, t.state, t.project, t.priority, t.nnotes, t.task) = row
+            t.where = t.state
+            yield t
+        return
+
+    def query(self, query):
+        # the tasks matching a TaskQuery, by state, then priority, then name
+        rows = self.db.execute(
+                    'SELECT name, state, project, priority, notes, task '
+                    'FROM tasks WHERE %s ORDER BY '
+                    "CASE state WHEN '%s' THEN 0 WHEN '%s' THEN 1 "
+                    "WHEN '%s' THEN 2 ELSE 3 END, "
+                    "CASE priority WHEN '%s' THEN 0 WHEN '%s' THEN 1 "
+                    'ELSE 2 END, name' %
+                    (query.where, ACTIVE, OPEN, DONE, HIGH, MEDIUM),
+                    query.args)
+        for row in rows:
+            t = Task()
+            (t.name, t.state, t.project, t.priority, t.nnotes, t.task) = row
+            t.where = t.state
+            yield t
+        return
+
+class TaskCache:
+    # Parsed tasks, kept in $XDG_CACHE_HOME/dbs so that a task file is
+    # only read and parsed again once it has changed.  Entries are keyed
+    # by path and checked against (inode, size, mtime); they are dropped
+    # least recently used first once there are more than CACHE_MAX.  The
+    # cache is purely an optimization: if it cannot be opened, every task
+    # is simply parsed from its file.
+    #
+    # The inode and mtime of each state directory are kept too, as of the
+    # last time every file in it was listed and cached; as long as the
+    # directory has not changed since, the scanner need not even list it.
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.pending = []
+        self.used = []
+        self.today = int(time.time()) // 86400
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.open()
+        except (OSError, sqlite3.DatabaseError):
+            if self.db:
+                self.db.close()
+            self.db = None
+            try:
+                os.remove(self.path)
+                self.open()
+            except (OSError, sqlite3.DatabaseError):
+                self.db = None
+        return
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.inode = os.stat(self.path).st_ino
+        # nothing here is precious, so do not wait for the disk
+        self.db.execute('PRAGMA synchronous = OFF')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_VERSION:
+            self.db.executescript('''
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS tasks;
+                ''')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                mtime INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                used INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                state TEXT NOT NULL,
+                project TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                notes TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_used ON tasks (used);
+            PRAGMA user_version = %d;
+            ''' % CACHE_VERSION)
+        return
+
+    def rows(self, dirpath):
+        # everything cached for one directory, by path
+        if not self.db:
+            return {}
+        prefix = os.path.join(dirpath, '')
+        rows = self.db.execute('SELECT * FROM tasks '
+                               'WHERE path >= ? AND path < ?',
+                               (prefix, prefix[:-1] + chr(ord(os.sep) + 1)))
+        return { row[0]:row for row in rows }
+
+    def listing(self, dirpath):
+        # the cached rows for one directory, plus the directory's (inode,
+        # mtime) if it needs listing again (None if the rows are complete)
+        st = os.stat(dirpath)
+        stamp = (st.st_ino, st.st_mtime_ns)
+        rows = self.rows(dirpath)
+        if self.db:
+            known = self.db.execute('SELECT inode, mtime FROM dirs '
+                                    'WHERE path = ?', (dirpath,)).fetchone()
+            if known == stamp:
+                return (rows, None)
+        return (rows, stamp)
+
+    def valid(self, path, st, rows):
+        row = rows.get(path)
+        return row and row[1:4] == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, path, st, rows):
+        if not self.valid(path, st, rows):
+            return None
+        return self.make(rows[path])
+
+    def make(self, row):
+        if row[4] != self.today:
+            self.used.append((self.today, row[0]))
+        t = Task()
+        t.name = os.path.basename(row[0])
+        t.where = os.path.basename(os.path.dirname(row[0]))
+        (t.task, t.state, t.project, t.priority) = row[5:9]
+        if row[9]:
+            t.notes = row[9].split('\n')
+        t.saved = (t.header(), len(t.notes))
+        return t
+
+    def put(self, task, path, st):
+        if not self.db:
+            return
+        self.pending.append((path, st.st_ino, st.st_size, st.st_mtime_ns,
+                             self.today, task.get_task(), task.get_state(),
+                             task.get_project(), task.get_priority(),
+                             '\n'.join(task.get_notes())))
+        return
+
+    def flush(self, dirpath=None, stamp=None, gone=None, touched=None):
+        # write out what we have learned; with a dirpath, the rows for that
+        # directory are complete as of its (pre-listing) inode and mtime.
+        # 'touched' maps directories we just wrote to to their mtime from
+        # before: if their cached listing was complete then, it still is.
+        if not self.db:
+            return
+        if gone is None:
+            gone = []
+        if touched is None:
+            touched = {}
+        if not (self.pending or self.used or gone or dirpath or touched):
+            return
+        mtimes = []
+        for ii in touched:
+            after = os.stat(ii).st_mtime_ns
+            if after != touched[ii]:
+                mtimes.append((after, ii, touched[ii]))
+        try:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO tasks '
+                                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    self.pending)
+                self.db.executemany('UPDATE tasks SET used = ? '
+                                    'WHERE path = ?', self.used)
+                self.db.executemany('DELETE FROM tasks WHERE path = ?',
+                                    [(ii,) for ii in gone])
+                if dirpath:
+                    self.db.execute('INSERT OR REPLACE INTO dirs '
+                                    'VALUES (?, ?, ?)', (dirpath,) + stamp)
+                self.db.executemany('UPDATE dirs SET mtime = ? '
+                                    'WHERE path = ? AND mtime = ?', mtimes)
+                if self.pending:
+                    self.evict()
+        except sqlite3.OperationalError:
+            # somebody else has it locked for too long; try again later
+            pass
+        self.pending = []
+        self.used = []
+        return
+
+    def evict(self):
+        (count,) = self.db.execute('SELECT count(*) FROM tasks').fetchone()
+        if count > CACHE_MAX:
+            self.db.execute('DELETE FROM tasks WHERE path IN '
+                            '(SELECT path FROM tasks ORDER BY used LIMIT ?)',
+                            (count - CACHE_MAX,))
+        return
+
+    def task(self, entry, rows):
+        # the parsed task for one DirEntry, from the cache if still valid
+        st = entry.stat()
+        t = self.get(entry.path, st, rows)
+        if t is None:
+            t = self.load(entry.path, st)
+        return t
+
+    def load(self, path, st):
+        # parse a task file the cache does not have (right), and keep it
+        t = Task()
+        t.populate(path, os.path.basename(path))
+        t.where = os.path.basename(os.path.dirname(path))
+        self.put(t, path, st)
+        return t
+
+class FileStore:
+    # Where the tasks are kept.  Nothing outside the store knows how they
+    # are laid out: the rest of dbs_task, dbs and dbsui all go through
+    # dbs_store().  A store provides:
+    #
+    #    create()                   make whatever the repo needs
+    #    get(name)                  the Task, notes and all, or None
+    #    fill(task)                 read in the notes of a Task known
+    #                               only by its summary (see lazy_task())
+    #    put(task, overwrite)       write a task where its state says
+    #    move(task, state)          change state, never being in two
+    #                               states at once, or in none
+    #    scan(states, project, since)   yield the Tasks in some states
+    #    allocate(reserve)          the next unused task name
+    #    locate(name)               the state a task is kept under, or None
+    #    mtime(name)                when it was last written, in ns
+    #    location(name, state)      where that is, to tell the user
+    #    stamp(state)               changes whenever anything in the
+    #                               state does; None if there is no state
+    #    in_place                   True if a task can change without the
+    #                               stamp of its state changing
+    #    changed(state, known)      (task, mtime, size) for each task in a
+    #                               state that is not as the index has it
+    #    flush(batch)               finish the writes in a TaskBatch
+    #    watcher()                  something with a changes() method,
+    #                               like TaskWatcher
+    #    revalidate()               for long running processes: catch up
+    #                               with changes made by others
+    #    close()                    let go of anything kept open
+    #
+    # and, for 'dbs convert' (see convert_store()):
+    #
+    #    export()                   (task, mtime) for every task, notes
+    #                               and all, checked with task_errors()
+    #    load(records, lastnum)     put in what another store exported
+    #    clear()                    remove every task, and the store itself
+    #
+    # Each task is read and written as a whole, and each write reports to
+    # task_written() so the index, the journal and any batch keep up.
+    # Every Task that came from the store has 'where' set to the state it
+    # is kept under; that may not be the state in the task itself if
+    # somebody moved it behind our back.
+    #
+    # This is the original layout: a directory per state, holding a text
+    # file per task named by its number.  Parsed tasks are cached (see
+    # TaskCache) so that unchanged files are not read again.
+    def __init__(self):
+        self.backend = FILES
+        self.repo = dbs_repo()
+        self.in_place = True        # a file edited where it is
+        return
+
+    def create(self):
+        if not dbs_data_dirs_exist():
+            dbs_make_data_dirs()
+        return
+
+    def path(self, name, state):
+        return os.path.join(dbs_repo(), state, name)
+
+    def get(self, name):
+        state = self.locate(name)
+        if not state:
+            return None
+        t = Task()
+        try:
+            t.populate(self.path(name, state), name)
+        except FileNotFoundError:
+            return None             # gone since we looked
+        t.where = state
+        return t
+
+    def fill(self, task):
+        # only the notes (and what was saved): the other fields may have
+        # been changed already
+        t = Task()
+        t.populate(self.path(task.name, task.where), task.name)
+        task.notes = t.notes
+        task.saved = t.saved
+        return
+
+    def write_file(self, task, fname):
         fd = open(fname, "w")
-        fd.write("Task: %s\n" % self.task)
-        fd.write("State: %s\n" % self.state)
-        fd.write("Project: %s\n" % self.project)
-        fd.write("Priority: %s\n" % self.priority)
-        if len(self.notes) > 0:
-            for ii in self.notes:
-                fd.write("Note: %s\n" % ii)
+        fd.write(task.text())
+        dbs_fsync(fd)
         fd.close()
+        task.saved = (task.header(), len(task.notes))
         return
 
-    def move(self, new_state):
+    def append_notes(self, task, fname):
+        # only notes were added since the file was read or written, so
+        # just add those to the end of it
+        (header, count) = task.saved
+        fd = open(fname, "ab+")
+        if fd.tell() > 0:
+            fd.seek(-1, os.SEEK_END)
+            if fd.read(1) != b'\n':
+                fd.write(b'\n')
+        for ii in task.notes[count:]:
+            fd.write(("Note: %s\n" % ii).encode())
+        dbs_fsync(fd)
+        fd.close()
+        task.saved = (header, len(task.notes))
+        return
+
+    def put(self, task, overwrite=False):
+        state = task.state
+        fname = self.path(task.name, state)
+        if not overwrite and os.path.isfile(fname):
+            print("? task %s already exists" % task.name)
+            sys.exit(1)
+        befores = { state:self.stamp(state) }
+        if overwrite and task.where == state and task.saved and \
+           task.saved[0] == task.header() and \
+           task.saved[1] <= len(task.notes) and os.path.isfile(fname):
+            self.append_notes(task, fname)
+        else:
+            self.write_file(task, fname)
+        task.where = state
+        task_written(task, state, befores)
+        return
+
+    def move(self, task, new_state):
+        # the new content goes to a temporary file next to the current
+        # one and is renamed over it, then that file is renamed into the
+        # new state directory
         if new_state not in ALLOWED_STATES:
             print("? \"%s\" is not an allowed state" % new_state)
             sys.exit(1)
-        fname = os.path.join(dbs_repo(), new_state, self.name)
+        fname = self.path(task.name, new_state)
         if os.path.isfile(fname):
-            print("? task %s already exists" % self.name)
+            print("? task %s already exists" % task.name)
             sys.exit(1)
-        fd = open(fname, "w")
-        fd.write("Task: %s\n" % self.task)
-        fd.write("State: %s\n" % new_state)
-        fd.write("State: %s\n" % self.state)
-        fd.write("Project: %s\n" % self.project)
-        fd.write("Priority: %s\n" % self.priority)
-        if len(self.notes) > 0:
-            for ii in self.notes:
-                fd.write("Note: %s\n" % ii)
+        old_state = task.where
+        if not old_state or not os.path.isfile(self.path(task.name,
+                                                         old_state)):
+            old_state = self.locate(task.name)
+        if not old_state:
+            old_state = new_state
+        oldpath = self.path(task.name, old_state)
+
+        befores = { old_state:self.stamp(old_state),
+                    new_state:self.stamp(new_state) }
+        task.state = new_state
+        tmppath = os.path.join(os.path.dirname(oldpath),
+                               '.%s.%d' % (task.name, os.getpid()))
+        self.write_file(task, tmppath)
+        os.rename(tmppath, oldpath)
+        gone = []
+        if oldpath != fname:
+            os.rename(oldpath, fname)
+            gone.append(old_state)
+            dbs_fsync_dir(os.path.dirname(oldpath))
+        dbs_fsync_dir(os.path.dirname(fname))
+        task.where = new_state
+        task_written(task, new_state, befores, gone)
+        return
+
+    def scan(self, states, project=None, since=None):
+        # each file is parsed, unless the cache has it already, skipping
+        # before the open() any file the index already says belongs to
+        # some other project
+        cache = dbs_cache()
+        for state in states:
+            dirpath = os.path.join(dbs_repo(), state)
+            (rows, stamp) = cache.listing(dirpath)
+            if stamp is None:
+                # nothing was added or removed since we last looked, so
+                # there is no need to list the directory; a file may still
+                # have been rewritten in place, though, and these tasks
+                # may well be written back, so each one is checked
+                for ii in rows:
+                    try:
+                        st = os.stat(ii)
+                    except FileNotFoundError:
+                        continue    # gone since; the next listing sees it
+                    if since is not None and st.st_mtime_ns <= since:
+                        continue
+                    if not cache.valid(ii, st, rows):
+                        t = cache.load(ii, st)
+                        if project is None or t.get_project() == project:
+                            yield t
+                        continue
+                    if project is not None and rows[ii][7] != project:
+                        continue
+                    yield cache.make(rows[ii])
+                cache.flush()
+                continue
+
+            known = {}
+            if project is not None:
+                known = dbs_index().projects(state)
+            complete = True
+            for entry in scan_dir(state):
+                if since is not None or known:
+                    st = entry.stat()
+                    skip = since is not None and st.st_mtime_ns <= since
+                    # only trust the index if the file has not changed since
+                    (proj, imtime) = known.get(entry.name, (project, None))
+                    if imtime == st.st_mtime_ns and proj != project:
+                        skip = True
+                    if skip:
+                        if not cache.valid(entry.path, st, rows):
+                            complete = False
+                        rows.pop(entry.path, None)
+                        continue
+                t = cache.task(entry, rows)
+                rows.pop(entry.path, None)
+                if project is None or t.get_project() == project:
+                    yield t
+            if complete:
+                cache.flush(dirpath, stamp, rows.keys())
+            else:
+                cache.flush()
+        return
+
+    def allocate(self, reserve=True):
+        return dbs_lastnum(os.path.join(dbs_repo(), LASTNUM), self, reserve)
+
+    def locate(self, name):
+        # ask the index first, but make sure the file is really there
+        state = dbs_index().lookup(name)
+        if state and os.path.isfile(self.path(name, state)):
+            return state
+
+        # not in the index (or not any more); it may have just shown up
+        for state in [ACTIVE, OPEN, DONE, DELETED]:
+            if os.path.isfile(self.path(name, state)):
+                return state
+        return None
+
+    def mtime(self, name):
+        return os.stat(self.path(name, self.locate(name))).st_mtime_ns
+
+    def location(self, name, state):
+        return self.path(name, state)
+
+    def stamp(self, state):
+        return dbs_dir_mtime(state)
+
+    def changed(self, state, known):
+        # known maps name -> (mtime, size), as the index has it; the names
+        # seen are taken out, leaving only those of the tasks now gone.
+        # Only a change means going to the cache.
+        cache = dbs_cache()
+        rows = None
+        for entry in scan_dir(state):
+            st = entry.stat()
+            if known.pop(entry.name, None) == (st.st_mtime_ns, st.st_size):
+                continue
+            if rows is None:
+                rows = cache.rows(os.path.join(dbs_repo(), state))
+            yield (cache.task(entry, rows), st.st_mtime_ns, st.st_size)
+        cache.flush()
+        return
+
+    def flush(self, batch):
+        # sync what was written if need be (a moved task under its new
+        # name), cache it, and return it as (task, state, mtime, size) for
+        # the index
+        if batch.sync:
+            dbs_fsync_paths(batch.sync |
+                            { self.path(ii, batch.written[ii][1])
+                              for ii in batch.written })
+        cache = dbs_cache()
+        written = []
+        for name in batch.written:
+            (task, state) = batch.written[name]
+            fname = self.path(name, state)
+            try:
+                st = os.stat(fname)
+            except FileNotFoundError:
+                continue            # somebody else moved it already
+            cache.put(task, fname, st)
+            written.append((task, state, st.st_mtime_ns, st.st_size))
+        gone = [ self.path(name, state) for (name, state) in batch.gone
+                 if batch.written[name][1] != state ]
+        touched = {}
+        for ii in batch.befores:
+            touched[os.path.join(dbs_repo(), ii)] = batch.befores[ii]
+        cache.flush(gone=gone, touched=touched)
+        return written
+
+    def watcher(self):
+        return TaskWatcher()
+
+    def revalidate(self):
+        return
+
+    def close(self):
+        return
+
+    def export(self):
+        # straight from the files, not the cache, so that nothing gets
+        # converted that the files do not say; blank lines carry nothing
+        for state in ALLOWED_STATES:
+            for entry in scan_dir(state):
+                lines = read_file(entry.path).split(b'\n')
+                data = b'\n'.join(ii for ii in lines if ii.strip())
+                ret = task_errors(data)
+                if ret:
+                    print("? %s: %s" % (entry.path, ret[2:]))
+                    sys.exit(1)
+                t = Task()
+                t.parse(data, entry.name)
+                t.where = state
+                yield (t, entry.stat().st_mtime_ns)
+        return
+
+    def load(self, records, lastnum):
+        for (task, mtime) in records:
+            fname = self.path(task.name, task.where)
+            self.write_file(task, fname)
+            os.utime(fname, ns=(mtime, mtime))
+        fd = open(os.path.join(dbs_repo(), LASTNUM), "w")
+        fd.write("%d\n" % int(lastnum))
         fd.close()
         return
 
+    def clear(self):
+        for state in ALLOWED_STATES:
+            for entry in scan_dir(state):
+                os.remove(entry.path)
+            try:
+                os.rmdir(os.path.join(dbs_repo(), state))
+            except OSError:
+                pass                # somebody left something else there
+        try:
+            os.remove(os.path.join(dbs_repo(), LASTNUM))
+        except FileNotFoundError:
+            pass
+        return
+
+class SqliteStore:
+    # The tasks kept as rows of a single sqlite database in the repo,
+    # STORE_DB, for repos with so many tasks that a file for each one
+    # costs too much (listing directories, inodes, backups).  It is a
+    # FileStore with the same tasks in a different place, so see there
+    # for what each method does; 'dbs convert' moves a repo from one
+    # to the other.
+    #
+    # The database is in WAL mode, so readers never wait for a writer.
+    # Each write is a transaction of its own, or, in a batch, the whole
+    # batch is one; with 'fsync: always' every commit is on disk before
+    # dbs goes on.  The notes are kept one per line in a single column,
+    # along with how many there are, and the stamp for each state is the
+    # mtime of the last task written to or moved out of it.  The indexes
+    # serve listings by state, project and priority, and the watcher,
+    # which finds changed tasks by their mtime.
+    def __init__(self):
+        self.backend = SQLITE
+        self.repo = dbs_repo()
+        self.in_place = False       # every write moves the stamp
+        self.path = os.path.join(self.repo, STORE_DB)
+        self.mtimes = {}
+        self.db = sqlite3.connect(self.path, timeout=30,
+                                  isolation_level=None)
+        self.inode = os.stat(self.path).st_ino
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in [0, STORE_VERSION]:
+            print("? %s was made by another version of dbs" % self.path)
+            sys.exit(1)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        if CONFIG_VALUES.get(FSYNC) == ALWAYS:
+            self.db.execute('PRAGMA synchronous = FULL')
+        else:
+            self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                project TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                nnotes INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                notes TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state
+                ON tasks (state, project, priority);
+            CREATE INDEX IF NOT EXISTS tasks_mtime ON tasks (mtime);
+            CREATE TABLE IF NOT EXISTS stamps (
+                state TEXT PRIMARY KEY,
+                stamp INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            PRAGMA user_version = %d;
+            ''' % STORE_VERSION)
+        self.db.executemany('INSERT OR IGNORE INTO stamps VALUES (?, ?)',
+                            [ (ii, time.time_ns()) for ii in ALLOWED_STATES ])
+        return
+
+    def begin(self):
+        # start a write transaction unless one is open (in a batch);
+        # True if this one started it
+        if self.db.in_transaction:
+            return False
+        self.db.execute('BEGIN IMMEDIATE')
+        return True
+
+    def exists(self, task):
+        # give up on the write: let go of the database (dbsd carries on
+        # after we exit) before saying why
+        if self.db.in_transaction:
+            self.db.execute('ROLLBACK')
+        print("? task %s already exists" % task.name)
+        sys.exit(1)
+
+    def make(self, row):
+        # a Task from (name, task, state, project, priority, notes)
+        t = Task()
+        (t.name, t.task, t.state, t.project, t.priority) = row[:5]
+        if row[5]:
+            t.notes = row[5].split('\n')
+        t.where = t.state
+        t.saved = (t.header(), len(t.notes))
+        return t
+
+    def create(self):
+        return
+
+    def get(self, name):
+        row = self.db.execute('SELECT name, task, state, project, priority, '
+                              'notes FROM tasks WHERE name = ?',
+                              (name,)).fetchone()
+        if row is None:
+            return None
+        return self.make(row)
+
+    def fill(self, task):
+        row = self.db.execute('SELECT task, state, project, priority, notes '
+                              'FROM tasks WHERE name = ?',
+                              (task.name,)).fetchone()
+        task.notes = []
+        if row and row[4]:
+            task.notes = row[4].split('\n')
+        task.saved = (tuple(row[:4]) if row else None, len(task.notes))
+        return
+
+    def write(self, task, state, old):
+        # the whole row every time; the notes are read in first, if need be.
+        # The journal tells what changed from what the index has, so the
+        # index has to be brought up to date before the row changes.
+        dbs_index()
+        notes = task.notes
+        befores = { state:self.stamp(state) }
+        gone = []
+        if old and old != state:
+            befores[old] = self.stamp(old)
+            gone.append(old)
+        (last,) = self.db.execute('SELECT max(mtime) FROM tasks').fetchone()
+        mtime = max(time.time_ns(), (last or 0) + 1)
+        self.db.execute('INSERT OR REPLACE INTO tasks '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (task.name, state, task.project, task.priority,
+                         len(notes), mtime, task.task, '\n'.join(notes)))
+        self.db.executemany('UPDATE stamps SET stamp = ? WHERE state = ?',
+                            [ (mtime, ii) for ii in befores ])
+        self.mtimes[task.name] = mtime
+        task.where = state
+        task.saved = (task.header(), len(notes))
+        task_written(task, state, befores, gone)
+        return
+
+    def put(self, task, overwrite=False):
+        self.begin()
+        old = self.locate(task.name)
+        if old and not overwrite:
+            self.exists(task)
+        self.write(task, task.state, old)
+        return
+
+    def move(self, task, new_state):
+        if new_state not in ALLOWED_STATES:
+            print("? \"%s\" is not an allowed state" % new_state)
+            sys.exit(1)
+        self.begin()
+        old = self.locate(task.name)
+        if old == new_state:
+            self.exists(task)
+        task.state = new_state
+        self.write(task, new_state, old)
+        return
+
+    def scan(self, states, project=None, since=None):
+        # only the summary of each task; the notes are read if needed
+        for state in states:
+            query = 'SELECT name, task, state, project, priority, nnotes ' \
+                    'FROM tasks WHERE state = ?'
+            args = [state]
+            if project is not None:
+                query += ' AND project = ?'
+                args.append(project)
+            if since is not None:
+                query += ' AND mtime > ?'
+                args.append(since)
+            for row in self.db.execute(query, args).fetchall():
+                yield lazy_task(*row, where=state)
+        return
+
+    def allocate(self, reserve=True):
+        began = self.begin()
+        row = self.db.execute("SELECT value FROM meta "
+                              "WHERE key = 'lastnum'").fetchone()
+        n = 1
+        if row:
+            n = row[0]
+        lnum = task_canonical_name(n)
+        while self.locate(lnum):
+            n = n + 1
+            lnum = task_canonical_name(n)
+        if reserve:
+            n = n + 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('lastnum', ?)",
+                        (n,))
+        if began:
+            self.db.execute('COMMIT')
+        return lnum
+
+    def locate(self, name):
+        row = self.db.execute('SELECT state FROM tasks WHERE name = ?',
+                              (name,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def mtime(self, name):
+        return self.db.execute('SELECT mtime FROM tasks WHERE name = ?',
+                               (name,)).fetchone()[0]
+
+    def location(self, name, state):
+        return '%s:%s/%s' % (self.path, state, name)
+
+    def stamp(self, state):
+        return self.db.execute('SELECT stamp FROM stamps WHERE state = ?',
+                               (state,)).fetchone()[0]
+
+    def changed(self, state, known):
+        rows = self.db.execute('SELECT name, task, state, project, priority, '
+                               'notes, mtime FROM tasks WHERE state = ?',
+                               (state,)).fetchall()
+        # a row has no size to speak of; 0 will do
+        for row in rows:
+            if known.pop(row[0], None) != (row[6], 0):
+                yield (self.make(row), row[6], 0)
+        return
+
+    def flush(self, batch):
+        if self.db.in_transaction:
+            self.db.execute('COMMIT')
+        written = []
+        for name in batch.written:
+            (task, state) = batch.written[name]
+            written.append((task, state, self.mtimes.pop(name), 0))
+        return written
+
+    def watcher(self):
+        return SqliteWatcher(self)
+
+    def revalidate(self):
+        # a command that gave up half way may have left its writes open
+        if self.db.in_transaction:
+            self.db.execute('ROLLBACK')
+        self.mtimes.clear()
+        return
+
+    def close(self):
+        self.db.close()
+        return
+
+    def export(self):
+        rows = self.db.execute('SELECT name, task, state, project, priority, '
+                               'notes, mtime FROM tasks ORDER BY name')
+        for row in rows:
+            t = self.make(row)
+            ret = t.validate(t.text().split('\n')[:-1])
+            if ret:
+                print("? %s: task %s: %s" % (self.path, t.name, ret[2:]))
+                sys.exit(1)
+            yield (t, row[6])
+        return
+
+    def load(self, records, lastnum):
+        self.begin()
+        self.db.executemany('INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [ (t.name, t.where, t.project, t.priority,
+                               len(t.notes), mtime, t.task, '\n'.join(t.notes))
+                              for (t, mtime) in records ])
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('lastnum', ?)",
+                        (int(lastnum),))
+        self.db.execute('COMMIT')
+        return
+
+    def clear(self):
+        self.db.close()
+        for ii in ['', '-wal', '-shm']:
+            try:
+                os.remove(self.path + ii)
+            except FileNotFoundError:
+                pass
+        return
+
+class LogStore:
+    # The tasks kept as records appended to segment files in LOG_DIR in
+    # the repo, another way around a file for each task.  Every write of
+    # a task, even one that only adds a note, appends the whole task as a
+    # new record to the last segment: a header (LOG_HEADER: magic, length,
+    # crc32 and mtime), then 'Name: <name>' and the task as text().  Only
+    # the end of the log is ever written, so a crash can at most cut the
+    # last record short, and that one is dropped.
+    #
+    # Where the latest record of each task is, along with its summary, is
+    # kept in memory (self.tasks) and read in from the log as it grows; a
+    # copy of that offset index is saved in LOG_INDEX now and then, so that
+    # only the records written since have to be read at start up.  Of two
+    # records for a task the one with the newer mtime wins, so the order
+    # they are read in does not matter.  Reading a task is a single
+    # pread() of its record.  Once more than half the log is superseded
+    # records, a process of its own copies the live ones to new segments
+    # and removes the old (see compact()).
+    #
+    # As in SqliteStore, the stamp for each state is the newest mtime of
+    # a task written to or moved out of it.
+    def __init__(self):
+        self.backend = LOG
+        self.repo = dbs_repo()
+        self.in_place = False       # every write moves the stamp
+        self.path = os.path.join(self.repo, LOG_DIR)
+        os.makedirs(self.path, exist_ok=True)
+        self.inode = os.stat(self.path).st_ino
+        self.fds = {}
+        self.recent = []
+        self.load_index()
+        self.catch_up()
+        return
+
+    def segment(self, n):
+        return os.path.join(self.path, '%08d%s' % (n, LOG_SUFFIX))
+
+    def segments(self):
+        # the segment numbers, oldest first
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(ii[:-len(LOG_SUFFIX)]) for ii in names
+                      if ii.endswith(LOG_SUFFIX) and
+                      ii[:-len(LOG_SUFFIX)].isdigit())
+
+    def fd(self, n):
+        if n not in self.fds:
+            self.fds[n] = os.open(self.segment(n), os.O_RDONLY)
+        return self.fds[n]
+
+    def reset(self):
+        # forget everything read from the log so far
+        for ii in self.fds:
+            os.close(self.fds[ii])
+        self.fds = {}
+        self.tasks = {}
+        self.stamps = {}
+        self.newest = 0
+        self.live = 0
+        self.pos = (0, 0)
+        self.unsaved = 0
+        return
+
+    def load_index(self):
+        # start from the saved offset index if there is a usable one, or
+        # else from nothing and read the whole log
+        self.reset()
+        try:
+            with open(os.path.join(self.path, LOG_INDEX), 'rb') as fd:
+                data = marshal.loads(fd.read())
+            if data['version'] != LOG_VERSION:
+                return
+            # kept a column at a time, which is much quicker to load; no
+            # garbage collection while the rows are made, as in dbsui
+            gc.disable()
+            try:
+                self.tasks = { ii[0]:list(ii[1:])
+                               for ii in zip(*data['tasks']) }
+            finally:
+                gc.enable()
+            (self.stamps, self.newest, self.live) = \
+                (data['stamps'], data['newest'], data['live'])
+            self.pos = tuple(data['pos'])
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            self.reset()
+        return
+
+    def save_index(self):
+        path = os.path.join(self.path, LOG_INDEX)
+        tmppath = '%s.%d' % (path, os.getpid())
+        names = list(self.tasks)
+        columns = [ names ] + [ [ self.tasks[ii][jj] for ii in names ]
+                                for jj in range(LOG_COLUMNS) ]
+        data = { 'version':LOG_VERSION, 'pos':self.pos, 'tasks':columns,
+                 'stamps':self.stamps, 'newest':self.newest,
+                 'live':self.live }
+        with open(tmppath, 'wb') as fd:
+            marshal.dump(data, fd)
+        os.replace(tmppath, path)
+        self.unsaved = 0
+        return
+
+    def catch_up(self):
+        # read in the records appended (by anybody) since we last looked
+        (pseg, poff) = self.pos
+        segs = self.segments()
+        for ii in [ ii for ii in self.fds if ii not in segs ]:
+            os.close(self.fds.pop(ii))      # compacted away
+        for n in segs:
+            if n < pseg:
+                continue
+            start = 0
+            if n == pseg:
+                start = poff
+            try:
+                fd = self.fd(n)
+            except FileNotFoundError:
+                continue
+            size = os.fstat(fd).st_size
+            if size < start:
+                # not the log the offsets were for: start over
+                self.reset()
+                return self.catch_up()
+            if size > start:
+                # parsed where it is, with no copy made
+                with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as data:
+                    start = self.replay(n, data, 0, start)
+            self.pos = (n, start)
+        if self.unsaved > LOG_INDEX_SLACK:
+            self.save_index()
+        return
+
+    def replay(self, seg, data, base, off=0, own=False):
+        # apply the complete records in data (all of segment 'seg' mapped
+        # in, or a chunk of it just written at offset 'base'), from 'off'
+        # on; returns the offset in the segment after the last one
+        with memoryview(data) as view:
+            while off + LOG_HEADER.size <= len(data):
+                (magic, length, crc, mtime) = LOG_HEADER.unpack_from(data,
+                                                                     off)
+                body = off + LOG_HEADER.size
+                end = body + length
+                if magic != LOG_MAGIC or end > len(data) or \
+                   zlib.crc32(view[body:end]) != crc:
+                    break           # cut short, or still being written
+                self.apply(seg, base + off, end - off, mtime, data, body,
+                           end, own)
+                off = end
+        return base + off
+
+    def apply(self, seg, off, size, mtime, data, body, end, own):
+        # one record, data[body:end]: a new version of a task, an old one,
+        # or the same one copied by a compaction
+        self.unsaved += size
+        nl = data.find(b'\n', body, end)
+        if nl < 0:
+            nl = end
+        name = data[body:nl].split(b':', 1)[1].strip().decode()
+        row = self.tasks.get(name)
+        if row and row[3] > mtime:
+            return
+        if row and row[3] == mtime:
+            self.live += size - row[2]
+            row[0:3] = [seg, off, size]
+            return
+
+        # the summary is all that is kept, so the notes are only counted
+        (task, state, project, priority, nnotes) = \
+            task_summary(data, nl + 1, end)
+        name = task_canonical_name(name)
+        if row:
+            self.live -= row[2]
+            if row[4] != state:
+                self.stamps[row[4]] = max(self.stamps.get(row[4], 0), mtime)
+        self.live += size
+        self.stamps[state] = max(self.stamps.get(state, 0), mtime)
+        self.newest = max(self.newest, mtime)
+        self.tasks[name] = [seg, off, size, mtime, state, task, project,
+                            priority, nnotes]
+        if not own:
+            self.recent.append(name)
+        return
+
+    def lock(self):
+        # only one writer at a time; readers never wait
+        fd = os.open(os.path.join(self.path, LOG_LOCK),
+                     os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def append(self, records):
+        # append (name, text, mtime) records to the end of the log, with
+        # the lock held and caught up
+        (seg, off) = self.pos
+        if seg == 0:
+            seg = 1
+        elif os.path.getsize(self.segment(seg)) > off:
+            # a record cut short by a crash is dropped first
+            os.truncate(self.segment(seg), off)
+        chunk = []
+        size = 0
+        for (name, text, mtime) in records:
+            body = ('Name: %s\n%s' % (name, text)).encode()
+            rec = LOG_HEADER.pack(LOG_MAGIC, len(body), zlib.crc32(body),
+                                  mtime) + body
+            if off + size > 0 and off + size + len(rec) > LOG_SEGMENT:
+                self.write_chunk(seg, off, chunk)
+                (seg, off, chunk, size) = (seg + 1, 0, [], 0)
+            chunk.append(rec)
+            size += len(rec)
+        self.write_chunk(seg, off, chunk)
+        return
+
+    def write_chunk(self, seg, off, chunk):
+        data = b''.join(chunk)
+        if data:
+            fd = open(self.segment(seg), 'ab')
+            fd.write(data)
+            dbs_fsync(fd)
+            fd.close()
+        self.pos = (seg, self.replay(seg, data, off, own=True))
+        return
+
+    def create(self):
+        return
+
+    def record(self, name):
+        # the latest record for a task, after the name, with a single
+        # pread(); if a compaction took its segment away, find out where
+        # it went
+        for ii in range(2):
+            row = self.tasks.get(name)
+            if row is None:
+                return None
+            try:
+                data = os.pread(self.fd(row[0]), row[2], row[1])
+                return data[data.find(b'\n', LOG_HEADER.size) + 1:]
+            except FileNotFoundError:
+                self.catch_up()
+        return None
+
+    def get(self, name):
+        data = self.record(name)
+        if data is None:
+            return None
+        t = Task()
+        t.parse(data, name)
+        t.where = t.state
+        return t
+
+    def fill(self, task):
+        # only the notes (and what was saved), as in FileStore
+        t = Task()
+        data = self.record(task.name)
+        if data is not None:
+            t.parse(data, task.name)
+        task.notes = t.notes
+        task.saved = t.saved
+        return
+
+    def write(self, task, state, overwrite, moving=False):
+        dbs_index()                 # see SqliteStore.write()
+        notes = task.notes
+        fd = self.lock()
+        try:
+            self.catch_up()
+            old = self.locate(task.name)
+            if (old and not overwrite) or (moving and old == state):
+                print("? task %s already exists" % task.name)
+                sys.exit(1)
+            befores = { state:self.stamp(state) }
+            gone = []
+            if old and old != state:
+                befores[old] = self.stamp(old)
+                gone.append(old)
+            task.state = state
+            self.append([(task.name, task.text(),
+                          max(time.time_ns(), self.newest + 1))])
+        finally:
+            os.close(fd)
+        task.where = state
+        task.saved = (task.header(), len(notes))
+        task_written(task, state, befores, gone)
+        return
+
+    def put(self, task, overwrite=False):
+        self.write(task, task.state, overwrite)
+        return
+
+    def move(self, task, new_state):
+        if new_state not in ALLOWED_STATES:
+            print("? \"%s\" is not an allowed state" % new_state)
+            sys.exit(1)
+        self.write(task, new_state, True, moving=True)
+        return
+
+    def scan(self, states, project=None, since=None):
+        # straight from the offset index; the notes are read if needed
+        rows = list(self.tasks.items())
+        for state in states:
+            for (name, row) in rows:
+                if row[4] != state:
+                    continue
+                if project is not None and row[6] != project:
+                    continue
+                if since is not None and row[3] <= since:
+                    continue
+                yield lazy_task(name, row[5], row[4], row[6], row[7],
+                                row[8], row[4])
+        return
+
+    def allocate(self, reserve=True):
+        return dbs_lastnum(os.path.join(self.path, LASTNUM), self, reserve)
+
+    def locate(self, name):
+        row = self.tasks.get(name)
+        if row:
+            return row[4]
+        return None
+
+    def mtime(self, name):
+        return self.tasks[name][3]
+
+    def location(self, name, state):
+        row = self.tasks.get(name)
+        if row is None:
+            return self.path
+        return '%s:%d' % (self.segment(row[0]), row[1])
+
+    def stamp(self, state):
+        return self.stamps.get(state)
+
+    def changed(self, state, known):
+        # the size is that of the latest record
+        rows = [ (name, row[3], row[2]) for (name, row) in self.tasks.items()
+                 if row[4] == state ]
+        for (name, mtime, size) in rows:
+            if known.pop(name, None) != (mtime, size):
+                t = self.get(name)
+                if t:
+                    yield (t, mtime, size)
+        return
+
+    def flush(self, batch):
+        if batch.sync:
+            dbs_fsync_paths(batch.sync)
+        written = []
+        for name in batch.written:
+            (task, state) = batch.written[name]
+            written.append((task, state, self.tasks[name][3],
+                            self.tasks[name][2]))
+        if self.unsaved > LOG_INDEX_SLACK:
+            self.save_index()
+        total = sum(os.path.getsize(self.segment(ii))
+                    for ii in self.segments())
+        if total > LOG_SEGMENT and self.live < total // 2:
+            self.compact_later()
+        return written
+
+    def compact_later(self):
+        # compact() in a process of its own, so nobody waits for it; that
+        # process is orphaned right away so nobody has to reap it either
+        pid = os.fork()
+        if pid:
+            os.waitpid(pid, 0)
+            return
+        try:
+            if os.fork() == 0:
+                os.setsid()
+                self.compact()
+        finally:
+            os._exit(0)
+
+    def compact(self):
+        # copy the latest record of each task to new segments, then remove
+        # the old ones.  Writers wait meanwhile; readers do not, and find
+        # the copies as they catch up (same mtime, new place).  Anybody
+        # with an old segment still open can go on reading it.
+        fd = self.lock()
+        try:
+            self.catch_up()
+            old = self.segments()
+            total = sum(os.path.getsize(self.segment(ii)) for ii in old)
+            if not old or self.live >= total // 2:
+                return              # somebody else just did it
+
+            seg = old[-1] + 1
+            off = 0
+            chunk = []
+            rows = sorted(self.tasks.values(), key=lambda r: (r[0], r[1]))
+            for row in rows:
+                if off > 0 and off + row[2] > LOG_SEGMENT:
+                    self.write_compacted(seg, chunk)
+                    (seg, off, chunk) = (seg + 1, 0, [])
+                chunk.append(os.pread(self.fd(row[0]), row[2], row[1]))
+                row[0:2] = [seg, off]
+                off += row[2]
+            self.write_compacted(seg, chunk)
+            self.pos = (seg, off)
+            self.save_index()
+            for ii in old:
+                if ii in self.fds:
+                    os.close(self.fds.pop(ii))
+                os.remove(self.segment(ii))
+        finally:
+            os.close(fd)
+        return
+
+    def write_compacted(self, seg, chunk):
+        # always synced, whatever the config says: the only other copy is
+        # about to be removed
+        tmppath = os.path.join(self.path, '.%08d%s' % (seg, LOG_SUFFIX))
+        fd = open(tmppath, 'wb')
+        fd.write(b''.join(chunk))
+        fd.flush()
+        os.fsync(fd.fileno())
+        fd.close()
+        os.replace(tmppath, self.segment(seg))
+        return
+
+    def watcher(self):
+        return LogWatcher(self)
+
+    def revalidate(self):
+        self.catch_up()
+        return
+
+    def close(self):
+        for ii in self.fds:
+            os.close(self.fds[ii])
+        self.fds = {}
+        return
+
+    def export(self):
+        for name in sorted(self.tasks):
+            data = b'\n'.join(ii for ii in self.record(name).split(b'\n')
+                              if ii.strip())
+            ret = task_errors(data)
+            if ret:
+                print("? %s: %s" % (self.location(name, None), ret[2:]))
+                sys.exit(1)
+            t = self.get(name)
+            yield (t, self.tasks[name][3])
+        return
+
+    def load(self, records, lastnum):
+        fd = self.lock()
+        try:
+            self.catch_up()
+            self.append([ (t.name, t.text(), mtime)
+                          for (t, mtime) in records ])
+        finally:
+            os.close(fd)
+        self.save_index()
+        fd = open(os.path.join(self.path, LASTNUM), "w")
+        fd.write("%d\n" % int(lastnum))
+        fd.close()
+        return
+
+    def clear(self):
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+        return
+
+class TaskBatch:
+    # Task writes that have not been recorded in the index and the cache
+    # yet.  Outside of batch_begin()/batch_end() each write is a batch of
+    # its own; inside, the tasks are written as usual but the index and
+    # cache are brought up to date in one transaction each at the end,
+    # and with 'fsync: always' the files and directories written ('sync')
+    # are all synced then instead of one at a time.  'befores' maps each
+    # state touched to its stamp from before, and 'gone' lists the (name,
+    # state) each move left.
+    def __init__(self):
+        self.written = {}
+        self.befores = {}
+        self.gone = []
+        self.sync = set()
+        self.journal = []
+        self.journaled = {}
+        return
+
+    def add(self, task, state, befores, gone):
+        self.written[task.name] = (task, state)
+        for ii in befores:
+            self.befores.setdefault(ii, befores[ii])
+        for ii in gone:
+            self.gone.append((task.name, ii))
+        return
+
+    def flush(self):
+        # the journal only once the store has the changes, so a snapshot
+        # taken in between replays them rather than missing them
+        written = dbs_store().flush(self)
+        if self.journal:
+            journal_write(self.journal)
+        dbs_index().update(written, self.befores)
+        return
+
+class TaskWatcher:
+    # Tells the caller which tasks changed on disk since it last asked,
+    # no matter who changed them: dbs, another dbsui, an editor or a
+    # plain 'mv'.  inotify is used when there is one (through ctypes, so
+    # there is nothing to install); otherwise the state directories are
+    # looked at every WATCH_POLL seconds, and listed again when changed.
+    def __init__(self):
+        self.fd = None
+        self.wds = {}
+        self.stamps = {}
+        self.listings = {}
+        self.last = time.time()
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.add_watch = libc.inotify_add_watch
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            fd = -1
+
+        if fd >= 0:
+            self.fd = fd
+            self.watch()
+        else:
+            for state in ALLOWED_STATES:
+                self.stamps[state] = dbs_dir_mtime(state)
+                self.listings[state] = self.listing(state)
+        return
+
+    def watch(self):
+        # watch any state directory not watched yet; True if there were
+        # some, since they may have changed while not watched
+        added = False
+        watched = self.wds.values()
+        for state in ALLOWED_STATES:
+            if state in watched:
+                continue
+            path = os.path.join(dbs_repo(), state)
+            wd = self.add_watch(self.fd, path.encode(), IN_MASK)
+            if wd >= 0:
+                self.wds[wd] = state
+                added = True
+        return added
+
+    def listing(self, state):
+        # name -> (inode, size, mtime) for every task in one state
+        listing = {}
+        try:
+            for entry in scan_dir(state):
+                st = entry.stat()
+                listing[entry.name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return listing
+
+    def changes(self):
+        # the names of the tasks changed since the last call; None if we
+        # lost track, and everything has to be looked at again
+        if self.fd is not None:
+            return self.events()
+        return self.compare()
+
+    def events(self):
+        changed = set()
+        lost = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                (wd, mask, cookie, size) = IN_EVENT.unpack_from(data, pos)
+                pos += IN_EVENT.size
+                name = data[pos:pos + size].rstrip(b'\0').decode()
+                pos += size
+                if mask & IN_Q_OVERFLOW:
+                    lost = True
+                elif mask & IN_IGNORED:
+                    # the directory itself went away
+                    self.wds.pop(wd, None)
+                    lost = True
+                elif name.isdigit():
+                    changed.add(name)
+
+        if len(self.wds) < len(ALLOWED_STATES) and self.watch():
+            lost = True
+        if lost:
+            return None
+        return changed
+
+    def compare(self):
+        changed = set()
+        now = time.time()
+        if now - self.last < WATCH_POLL:
+            return changed
+        self.last = now
+
+        for state in ALLOWED_STATES:
+            mtime = dbs_dir_mtime(state)
+            if mtime == self.stamps[state]:
+                continue
+            self.stamps[state] = mtime
+            old = self.listings[state]
+            new = self.listing(state)
+            for name in set(old) | set(new):
+                if old.get(name) != new.get(name):
+                    changed.add(name)
+            self.listings[state] = new
+        return changed
+
+class SqliteWatcher:
+    # TaskWatcher for a SqliteStore: sqlite tells us whether anybody else
+    # wrote to the database since we last asked, and the tasks changed
+    # are those written since the newest mtime we have seen.
+    def __init__(self, store):
+        self.db = store.db
+        self.changes_seen = self.data_version()
+        self.mtime = self.newest()
+        return
+
+    def data_version(self):
+        return self.db.execute('PRAGMA data_version').fetchone()[0]
+
+    def newest(self):
+        (mtime,) = self.db.execute('SELECT max(mtime) FROM tasks').fetchone()
+        return mtime or 0
+
+    def changes(self):
+        changed = set()
+        version = self.data_version()
+        if version == self.changes_seen:
+            return changed
+        self.changes_seen = version
+        for (name, mtime) in self.db.execute('SELECT name, mtime FROM tasks '
+                                             'WHERE mtime > ?', (self.mtime,)):
+            changed.add(name)
+            self.mtime = max(self.mtime, mtime)
+        return changed
+
+class LogWatcher:
+    # TaskWatcher for a LogStore: the tasks others appended to the log
+    # since we last asked
+    def __init__(self, store):
+        self.store = store
+        self.seen = len(store.recent)
+        return
+
+    def changes(self):
+        self.store.catch_up()
+        changed = set(self.store.recent[self.seen:])
+        self.seen = len(self.store.recent)
+        return changed
+
+class TaskQuery:
+    # A filter expression such as
+    #
+    #    state in (open,active) and project=infra and pri>=m and notes>3
+    #
+    # compiled once into an SQL condition on the index's tasks table, so
+    # that sqlite can use the index on (state, project, priority) rather
+    # than look at every task.  Terms are <field> <op> <value>, or
+    # <field> [not] in (<value>, ...), joined with and, or, not and
+    # parentheses.  Priorities compare as l < m < h, names as numbers,
+    # age is in days since the task was last changed, and task ~ <word>
+    # is true if the task text contains <word>.  Without a state term,
+    # only active and open tasks are looked at.
+    FIELDS = { 'name':'name', 'state':'state', 'project':'project',
+               'priority':'priority', 'pri':'priority', 'notes':'notes',
+               'age':'mtime', 'task':'task' }
+    ORDERED = ['name', 'priority', 'notes', 'age']
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self.tokenize(text)
+        self.pos = 0
+        self.states = False
+        self.args = []
+        self.now = time.time_ns()
+        where = self.expr()
+        if self.pos < len(self.tokens):
+            self.error("unexpected \"%s\"" % self.tokens[self.pos][1])
+        if not self.states:
+            where = "state IN ('%s', '%s') AND (%s)" % (ACTIVE, OPEN, where)
+        self.where = where
+        return
+
+    def error(self, msg):
+        print("? bad query: %s" % msg)
+        sys.exit(1)
+
+    def tokenize(self, text):
+        # (kind, text) pairs: 'op' for punctuation, 'word' otherwise
+        tokens = []
+        text = text.strip()
+        pos = 0
+        while pos < len(text):
+            m = RE_QUERY.match(text, pos)
+            if not m or m.end() == pos:
+                self.error("cannot make sense of \"%s\"" % text[pos:])
+            if m.group(1):
+                tokens.append(('op', m.group(1)))
+            elif m.group(4) is not None:
+                tokens.append(('word', m.group(4)))
+            else:
+                value = m.group(2) if m.group(2) is not None else m.group(3)
+                tokens.append(('quoted', value))
+            pos = m.end()
+        return tokens
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self, what):
+        if self.pos >= len(self.tokens):
+            self.error("expected %s at the end" % what)
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def keyword(self, word):
+        (kind, text) = self.peek()
+        if kind == 'word' and text.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def expr(self):
+        terms = [self.conjunction()]
+        while self.keyword('or'):
+            terms.append(self.conjunction())
+        if len(terms) == 1:
+            return terms[0]
+        return '(%s)' % ' OR '.join(terms)
+
+    def conjunction(self):
+        terms = [self.factor()]
+        while self.keyword('and'):
+            terms.append(self.factor())
+        if len(terms) == 1:
+            return terms[0]
+        return '(%s)' % ' AND '.join(terms)
+
+    def factor(self):
+        if self.keyword('not'):
+            return 'NOT %s' % self.factor()
+        if self.peek() == ('op', '('):
+            self.pos += 1
+            where = self.expr()
+            if self.next("')'") != ('op', ')'):
+                self.error("expected ')'")
+            return where
+        return self.term()
+
+    def term(self):
+        (kind, field) = self.next('a field name')
+        if kind != 'word' or field.lower() not in self.FIELDS:
+            self.error("unknown field \"%s\", expected one of: %s" %
+                       (field, ', '.join(self.FIELDS)))
+        field = field.lower()
+        if field == 'pri':
+            field = 'priority'
+        if field == 'state':
+            self.states = True
+
+        negate = self.keyword('not')
+        if self.keyword('in'):
+            if field in ['age', 'task']:
+                self.error("in does not work on %s" % field)
+            if self.next("'('") != ('op', '('):
+                self.error("expected '(' after in")
+            values = [self.value(field)]
+            while self.peek() == ('op', ','):
+                self.pos += 1
+                values.append(self.value(field))
+            if self.next("')'") != ('op', ')'):
+                self.error("expected ')' after the values for %s" % field)
+            values = [ ii for v in values for ii in self.values(field, '=', v) ]
+            return self.member(field, values, negate)
+        if negate:
+            self.error("expected in after not")
+
+        (kind, op) = self.next('an operator')
+        if kind != 'op' or op in ['(', ')', ',']:
+            self.error("expected an operator after %s" % field)
+        if op in ['<', '<=', '>', '>='] and field not in self.ORDERED:
+            self.error("%s can only be compared with =, != or in" % field)
+        value = self.value(field)
+        if op == '~':
+            if field != 'task':
+                self.error("~ only works on the task text")
+            self.args.append('%' + value.replace('\\', '\\\\')
+                                        .replace('%', '\\%')
+                                        .replace('_', '\\_') + '%')
+            return "task LIKE ? ESCAPE '\\'"
+        if field in ['state', 'priority']:
+            # compared by rank, so list the values that pass
+            if op == '!=':
+                return self.member(field, self.values(field, '=', value),
+                                   True)
+            return self.member(field, self.values(field, op, value), False)
+        if field == 'age':
+            # older means a smaller mtime
+            op = { '<':'>', '<=':'>=', '>':'<', '>=':'<=' }.get(op, op)
+            if op in ['=', '!=']:
+                self.error("age can only be compared with <, <=, > or >=")
+        self.args.append(value)
+        return '%s %s ?' % (self.FIELDS[field], op)
+
+    def value(self, field):
+        (kind, value) = self.next('a value for %s' % field)
+        if kind == 'op':
+            self.error("expected a value for %s, got \"%s\"" % (field, value))
+        if field == 'name':
+            if not value.isdigit():
+                self.error("task names are numbers, not \"%s\"" % value)
+            return task_canonical_name(value)
+        if field == 'notes':
+            if not value.isdigit():
+                self.error("notes is a count, not \"%s\"" % value)
+            return int(value)
+        if field == 'age':
+            try:
+                days = float(value)
+            except ValueError:
+                self.error("age is a number of days, not \"%s\"" % value)
+            return self.now - int(days * 24 * 3600 * 1e9)
+        if field == 'priority' and value not in [LOW, MEDIUM, HIGH]:
+            self.error("\"%s\" is not a priority, expected h, m or l" % value)
+        if field == 'state' and value not in ALLOWED_STATES:
+            self.error("\"%s\" is not an allowed state" % value)
+        return value
+
+    def values(self, field, op, value):
+        # the values of an ordered field that 'op value' lets through
+        if field == 'priority':
+            order = [LOW, MEDIUM, HIGH]
+        else:
+            return [value]
+        rank = order.index(value)
+        return [ ii for ii in order
+                 if { '=': order.index(ii) == rank,
+                      '<': order.index(ii) < rank,
+                      '<=': order.index(ii) <= rank,
+                      '>': order.index(ii) > rank,
+                      '>=': order.index(ii) >= rank }[op] ]
+
+    def member(self, field, values, negate):
+        if not values:
+            return 'NOT 0' if negate else '0'
+        self.args.extend(values)
+        return '%s %sIN (%s)' % (self.FIELDS[field], 'NOT ' if negate else '',
+                                 ','.join('?' * len(values)))
+
 #-- helper functions
+def batch_begin():
+    global BATCH
+
+    BATCH = TaskBatch()
+    return
+
+def batch_end():
+    global BATCH
+
+    batch = BATCH
+    BATCH = None
+    batch.flush()
+    return
+
 def dbs_repo():
     global CONFIG_VALUES
 
@@ -292,6 +2305,161 @@ def dbs_repo():
     else:
         return os.path.join(os.getenv("HOME"), '.config', 'dbs')
 
+def dbs_dir_mtime(state):
+    try:
+        return os.stat(os.path.join(dbs_repo(), state)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def dbs_cache():
+    global CACHE_DB
+
+    if not CACHE_DB:
+        cache_home = os.getenv("XDG_CACHE_HOME")
+        if not cache_home:
+            cache_home = os.path.join(os.getenv("HOME"), '.cache')
+        CACHE_DB = TaskCache(os.path.join(cache_home, 'dbs', CACHE))
+    return CACHE_DB
+
+def dbs_fsync(fd):
+    # make sure a task file is on disk, if the config asks for that; in
+    # a batch, it is synced along with the rest at the end instead
+    if CONFIG_VALUES.get(FSYNC) != ALWAYS:
+        return
+    if BATCH:
+        BATCH.sync.add(os.path.abspath(fd.name))
+    else:
+        fd.flush()
+        os.fsync(fd.fileno())
+    return
+
+def dbs_fsync_dir(path):
+    # same, for the directory entries after a rename
+    if CONFIG_VALUES.get(FSYNC) != ALWAYS:
+        return
+    if BATCH:
+        BATCH.sync.add(os.path.abspath(path))
+    else:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return
+
+def dbs_fsync_paths(paths):
+    # the end of a batch: sync the files it wrote, then the directories;
+    # a file renamed since is synced under its new name by the caller
+    for ii in sorted(paths, key=os.path.isdir):
+        try:
+            fd = os.open(ii, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return
+
+def dbs_backend():
+    return CONFIG_VALUES.get(BACKEND, FILES)
+
+def dbs_make_store(backend):
+    if backend == SQLITE:
+        return SqliteStore()
+    if backend == LOG:
+        return LogStore()
+    return FileStore()
+
+def dbs_store():
+    global STORE
+
+    if not STORE:
+        STORE = dbs_make_store(dbs_backend())
+    return STORE
+
+def dbs_index():
+    global INDEX_DB
+
+    if not INDEX_DB:
+        INDEX_DB = TaskIndex(os.path.join(dbs_repo(), INDEX))
+    return INDEX_DB
+
+def dbs_replaced(path, inode):
+    try:
+        return os.stat(path).st_ino != inode
+    except FileNotFoundError:
+        return True
+
+def dbs_revalidate():
+    # dbsd runs many commands in one process: make sure nothing it keeps
+    # around is stale, once the config has been read again
+    global INDEX_DB, CACHE_DB, STORE
+
+    if STORE:
+        if STORE.backend != dbs_backend() or STORE.repo != dbs_repo() or \
+           (STORE.backend != FILES and
+            dbs_replaced(STORE.path, STORE.inode)):
+            STORE.close()
+            STORE = None
+        else:
+            STORE.revalidate()
+    if INDEX_DB:
+        if INDEX_DB.path != os.path.join(dbs_repo(), INDEX) or \
+           dbs_replaced(INDEX_DB.path, INDEX_DB.inode):
+            INDEX_DB.db.close()
+            INDEX_DB = None
+        else:
+            INDEX_DB.revalidate()
+    if CACHE_DB:
+        if CACHE_DB.db and dbs_replaced(CACHE_DB.path, CACHE_DB.inode):
+            CACHE_DB.db.close()
+            CACHE_DB = None
+        else:
+            CACHE_DB.today = int(time.time()) // 86400
+    return
+
+def dbs_socket_name():
+    runtime = os.getenv("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, 'dbs', DBSD_SOCKET)
+    return os.path.join(os.getenv("HOME"), '.config', 'dbs', DBSD_SOCKET)
+
+def dbsd_request(request):
+    # send a request to dbsd and return its reply, or None if there is
+    # no dbsd running to ask, or none that answers in time.  dbsd says
+    # when it has read the request, and only acts on it once told to go
+    # ahead: until then, a dbsd that is stopped or stuck (or busy with
+    # somebody else) is given up on, and the caller can do the work
+    # itself without it being done twice.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(DBSD_TIMEOUT)
+    fd = sock.makefile('rb')
+    try:
+        sock.connect(dbs_socket_name())
+        sock.sendall((json.dumps(request) + '\n').encode())
+        if not json.loads(fd.readline()).get('ready'):
+            raise ValueError
+        sock.sendall((json.dumps({ 'go': True }) + '\n').encode())
+    except (OSError, ValueError, AttributeError):
+        fd.close()
+        sock.close()
+        return None
+
+    # from here on, dbsd may have done the work already: never run it
+    # again locally, just report the trouble; how long the command takes
+    # is up to the command
+    sock.settimeout(None)
+    try:
+        reply = json.loads(fd.readline())
+    except (OSError, ValueError):
+        print("? lost the connection to dbsd")
+        sys.exit(1)
+    finally:
+        fd.close()
+        sock.close()
+    return reply
+
 def dbs_config_name():
     return os.path.join(os.getenv("HOME"), '.config', 'dbs', CONFIG)
 
@@ -324,6 +2492,7 @@ def dbs_defconfig():
 def dbs_read_config():
     global CONFIG_VALUES
 
+    CONFIG_VALUES.clear()
     fname = dbs_config_name()
     fd = open(fname, "r")
     for ii in fd.readlines():
@@ -331,7 +2500,40 @@ def dbs_read_config():
         if RE_REPO.search(line):
             fields = line.split(':')
             CONFIG_VALUES[REPO] = fields[1].strip()
+        elif RE_FSYNC.search(line):
+            fields = line.split(':')
+            policy = fields[1].strip()
+            if policy not in [ALWAYS, NEVER]:
+                print("? fsync must be '%s' or '%s'" % (ALWAYS, NEVER))
+                sys.exit(1)
+            CONFIG_VALUES[FSYNC] = policy
+        elif RE_BACKEND.search(line):
+            fields = line.split(':')
+            backend = fields[1].strip()
+            if backend not in BACKENDS:
+                print("? repo_backend must be one of: %s" %
+                      ', '.join(BACKENDS))
+                sys.exit(1)
+            CONFIG_VALUES[BACKEND] = backend
+    fd.close()
+    return
+
+def dbs_write_config(key, value):
+    # set 'key: value' in the config file, replacing any line for it
+    fname = dbs_config_name()
+    fd = open(fname, "r")
+    lines = [ ii for ii in fd.readlines()
+              if not re.match('^%s:' % key, ii.strip()) ]
+    fd.close()
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    lines.append("%s: %s\n" % (key, value))
+    tmpname = fname + '.tmp'
+    fd = open(tmpname, "w")
+    fd.writelines(lines)
     fd.close()
+    os.replace(tmpname, fname)
+    dbs_read_config()
     return
 
 def dbs_make_data_dirs():
@@ -348,32 +2550,91 @@ def dbs_make_data_dirs():
 def dbs_make_repo():
     print("dbs repo not found, creating defaults in %s" % dbs_repo())
     os.mkdir(dbs_repo())
-    dbs_make_data_dirs()
+    dbs_store().create()
     return
 
-def dbs_next():
-    # assuming task names are numbers, get the next unused number
-    lnumpath = os.path.join(dbs_repo(), LASTNUM)
-    if os.path.exists(lnumpath):
-        fd = open(lnumpath, "r")
-        data = fd.readline()
-        fd.close()
-    if len(data) > 1:
-        n = int(data.strip())
-    else:
-        n = 1
-    fd = open(lnumpath, "w")
-    fd.seek(0)
-    lnum = task_canonical_name(n)
-
-    while task_name_exists(lnum):
-        n = n + 1
+def dbs_lastnum(lnumpath, store, reserve):
+    # assuming task names are numbers, get the next unused number in a
+    # store that keeps its next number in lnumpath
+    #
+    # lastnum is locked while we look so that two dbs processes can
+    # never hand out the same number; unless we are only peeking, the
+    # number is reserved by leaving the one after it in lastnum
+    fd = os.open(lnumpath, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        data = os.read(fd, 64).decode().strip()
+        if data.isdigit():
+            n = int(data)
+        else:
+            n = 1
         lnum = task_canonical_name(n)
 
-    fd.write("%d\n" % n)
-    fd.close()
+        while store.locate(lnum):
+            n = n + 1
+            lnum = task_canonical_name(n)
+
+        if reserve:
+            n = n + 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, ("%d\n" % n).encode())
+    finally:
+        os.close(fd)
     return lnum
 
+def dbs_next(reserve=True):
+    return dbs_store().allocate(reserve)
+
+def convert_store(backend):
+    # move every task, and the next task number, to another backend,
+    # keeping each task's mtime; the repo only switches over once the
+    # new store reads back exactly what the old one had, and only then
+    # is the old one removed.  Returns the number of tasks moved.
+    global STORE
+
+    src = dbs_store()
+    if src.backend == backend:
+        print("? the repo already uses the %s backend" % backend)
+        sys.exit(1)
+    records = []
+    seen = {}
+    for (t, mtime) in src.export():
+        if t.state != t.where:
+            print("? task %s is kept in %s but its State: is %s" %
+                  (t.name, t.where, t.state))
+            sys.exit(1)
+        if t.name in seen:
+            print("? task %s is kept in both %s and %s" %
+                  (t.name, seen[t.name], t.where))
+            sys.exit(1)
+        seen[t.name] = t.where
+        records.append((t, mtime))
+    records.sort(key=lambda r: r[0].name)
+    lastnum = src.allocate(reserve=False)
+
+    dst = dbs_make_store(backend)
+    dst.create()
+    for (t, mtime) in dst.export():
+        print("? the %s backend already holds tasks (%s, for one)" %
+              (backend, t.name))
+        sys.exit(1)
+    dst.load(records, lastnum)
+    copied = sorted(dst.export(), key=lambda r: r[0].name)
+    if [ (t.where, t.text(), m) for (t, m) in copied ] != \
+       [ (t.where, t.text(), m) for (t, m) in records ] or \
+       dst.allocate(reserve=False) != lastnum:
+        dst.clear()
+        print("? the %s backend did not keep the tasks as they were; "
+              "nothing was changed" % backend)
+        sys.exit(1)
+
+    dbs_write_config(BACKEND, backend)
+    src.close()
+    src.clear()
+    STORE = dst
+    return len(records)
+
 def fix_task(info):
     # munge up the task string if it's longer than one line
     # NB: all the lengths and stuff are figured out by hand
@@ -401,10 +2662,9 @@ def fix_task(info):
 
     return res
 
-def get_last_modified_time(fullpath):
-    fname = pathlib.Path(fullpath)
-    stat = fname.stat()
-    mtime = datetime.datetime.fromtimestamp(stat.st_mtime)
+def get_last_modified_time(name):
+    ns = dbs_store().mtime(task_canonical_name(name))
+    mtime = datetime.datetime.fromtimestamp(ns / 1e9)
     mstr = mtime.strftime("%Y-%m-%d %H:%M:%S")
 
     tzS, tzD = time.tzname
@@ -416,13 +2676,11 @@ def get_last_modified_time(fullpath):
     return mstr + tz
 
 def get_task(name):
-    fullpath = task_name_exists(name)
-    if not fullpath:
+    t = None
+    if name:
+        t = dbs_store().get(task_canonical_name(name))
+    if not t:
         print("? task \"%s\" is not defined" % name)
-        return None
-
-    t = Task()
-    t.populate(fullpath, name)
     return t
 
 def list_tasks(state, add_space=False):
@@ -430,14 +2688,10 @@ def list_tasks(state, add_space=False):
         print("? unknown task state requested")
         sys.exit(1)
 
-    fullpath = os.path.join(dbs_repo(), state)
     tasks = {}
     task_cnt = 0
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-        for ii in filenames:
-           t = Task()
-           t.populate(os.path.join(fullpath, ii), ii)
-           tasks[ii] = t
+    for t in scan_tasks(state, summary=True):
+        tasks[t.get_name()] = t
 
     if len(tasks) < 1:
         print("No %s tasks found." % state)
@@ -479,21 +2733,340 @@ def print_tasks_found(count, space=True):
     print("%d task%s found." % (count, suffix))
     return
 
+def print_summaries_found(summaries):
+    count = 0
+    for ii in summaries:
+        count += summaries[ii][HIGH] + summaries[ii][MEDIUM] + \
+                 summaries[ii][LOW]
+
+    psuffix = ''
+    if len(summaries) > 1:
+        psuffix = 's'
+    tsuffix = ''
+    if count > 1:
+        tsuffix = 's'
+    print("")
+    print("%d project%s with %d task%s" % (len(summaries), psuffix,
+          count, tsuffix))
+    return
+
+def project_summaries(states):
+    return dbs_index().summaries(states)
+
+def search_tasks(terms, states=None):
+    # the tasks matching all of the terms (as word prefixes), best first
+    if states is None:
+        states = [ACTIVE, OPEN, DONE]
+    index = dbs_index()
+    if not index.searchable:
+        print("? searching needs a sqlite with FTS5")
+        sys.exit(1)
+    terms = [ ii for ii in terms if ii.strip('"') ]
+    if not terms:
+        return []
+    return list(index.search(terms, states))
+
+def query_tasks(text):
+    # stream the tasks matching a query expression (see TaskQuery)
+    return dbs_index().query(TaskQuery(text))
+
 def put_task(task, overwrite=True):
     task.write(overwrite=overwrite)
     return
 
+def select_tasks(params, states=None):
+    # the tasks a multi-task command works on: each param is a task name
+    # or a field=value term (project, state or priority; value can be a
+    # comma separated list).  The terms select every task that matches
+    # all of them, looking only at 'states' (active and open, unless
+    # given) unless there is a state term.
+    if states is None:
+        states = [ACTIVE, OPEN]
+    tasks = []
+    names = set()
+    terms = {}
+    for ii in params:
+        if '=' not in ii:
+            t = get_task(ii)
+            if t and t.get_name() not in names:
+                names.add(t.get_name())
+                tasks.append(t)
+            continue
+        (field, value) = ii.split('=', 1)
+        if field not in SELECT_FIELDS:
+            print("? unknown field \"%s\", expected one of: %s" %
+                  (field, ', '.join(SELECT_FIELDS)))
+            sys.exit(1)
+        terms[field] = value.split(',')
+    if not terms:
+        return tasks
+
+    if 'state' in terms:
+        states = terms['state']
+        for ii in states:
+            if ii not in ALLOWED_STATES:
+                print("? \"%s\" is not an allowed state" % ii)
+                sys.exit(1)
+    project = None
+    if 'project' in terms and len(terms['project']) == 1:
+        project = terms['project'][0]
+    found = []
+    for t in scan_tasks(states, project=project):
+        if t.get_name() in names or not task_selected(t, terms):
+            continue
+        # the command writes these back, so they have to be what the
+        # store holds now and not what a cache remembers
+        t = dbs_store().get(t.get_name())
+        if t and t.where in states and task_selected(t, terms):
+            found.append(t)
+    return tasks + sorted(found)
+
+def task_selected(t, terms):
+    # does a task match the project and priority terms of select_tasks()
+    if 'project' in terms and t.get_project() not in terms['project']:
+        return False
+    if 'priority' in terms and t.get_priority() not in terms['priority']:
+        return False
+    return True
+
+def scan_dir(state):
+    # yield the DirEntry of each task file in one state directory
+    fullpath = os.path.join(dbs_repo(), state)
+    with os.scandir(fullpath) as entries:
+        for entry in entries:
+            if entry.name.isdigit() and entry.is_file():
+                yield entry
+    return
+
+def scan_tasks(states=ALLOWED_STATES, project=None, since=None,
+               summary=False):
+    # yield a Task for each task in the given state(s), optionally only
+    # for one project and/or only those modified after 'since' (in ns).
+    # With summary set, tasks come straight from the index and carry a
+    # note count but no notes; otherwise they come from the store.
+    if isinstance(states, str):
+        states = [states]
+
+    if not summary:
+        yield from dbs_store().scan(states, project, since)
+        return
+    for state in states:
+        yield from dbs_index().tasks(state, project, since)
+    return
+
+def task_written(task, state, befores, gone=None):
+    # keep the journal, the index and the store's caches in step with a
+    # task the store just wrote in 'state', and the states it was moved
+    # from if any; 'befores' maps each state touched to its stamp from
+    # before
+    if gone is None:
+        gone = []
+    batch = BATCH
+    if not batch:
+        batch = TaskBatch()
+    journal_task(task, batch)
+    batch.add(task, state, befores, gone)
+    if not BATCH:
+        batch.flush()
+    return
+
+def journal_task(task, batch):
+    # one journal record for a change to a task: when, which task, the
+    # fields that changed (old and new values), any notes added, and any
+    # dropped; a new task has no old values.  The old values are what
+    # the index (or this batch) last recorded for the task.  The index
+    # only has a count of the notes, which is all it takes to find the
+    # ones added to the end; notes replaced as a whole (an edit) come
+    # with the ones they replace, in old_notes.
+    new = dict(zip(JOURNAL_FIELDS, task.header()))
+    if task.name in batch.journaled:
+        before = batch.journaled[task.name]
+    else:
+        before = dbs_index().fields(task.name)
+
+    record = { 't':time.time_ns(), 'name':task.name }
+    if before is None:
+        record['new'] = new
+        added = task.notes
+    else:
+        (old, count) = before
+        changed = [ ii for ii in JOURNAL_FIELDS if old[ii] != new[ii] ]
+        if changed:
+            record['old'] = { ii:old[ii] for ii in changed }
+            record['new'] = { ii:new[ii] for ii in changed }
+        added = task.notes[count:]
+        if task.old_notes is not None:
+            same = 0
+            for (old_note, new_note) in zip(task.old_notes, task.notes):
+                if old_note != new_note:
+                    break
+                same += 1
+            added = task.notes[same:]
+            if task.old_notes[same:]:
+                record['dropped'] = task.old_notes[same:]
+    task.old_notes = None           # the store has these notes now
+    if added:
+        record['notes'] = added
+    if 'new' not in record and 'notes' not in record and \
+       'dropped' not in record:
+        return                  # written again, but nothing to tell
+
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    batch.journaled[task.name] = (new, len(task.notes))
+    batch.journal.append(line)
+    return
+
+def journal_write(lines):
+    # append records to the journal in a single write, so that two
+    # commands writing at once never mix up their records; a record cut
+    # short by a crash is left on a line of its own
+    data = ''.join(lines).encode()
+    fd = open(os.path.join(dbs_repo(), JOURNAL), 'ab+', buffering=0)
+    if fd.tell() > 0:
+        fd.seek(-1, os.SEEK_END)
+        if fd.read(1) != b'\n':
+            data = b'\n' + data
+    fd.write(data)
+    dbs_fsync(fd)
+    fd.close()
+    return
+
+def journal_records(since=None, name=None):
+    # the journal records, newest first; with 'since' (in ns), stop at
+    # the first record that old, so only the tail of the file is read.
+    # With 'name', only that task's records, skipping the others unparsed.
+    if name is not None:
+        name = ('"name":"%s"' % name).encode()
+    try:
+        fd = open(os.path.join(dbs_repo(), JOURNAL), 'rb')
+    except FileNotFoundError:
+        return
+    with fd:
+        end = fd.seek(0, os.SEEK_END)
+        rest = b''
+        while end > 0:
+            start = max(0, end - JOURNAL_BLOCK)
+            fd.seek(start)
+            lines = (fd.read(end - start) + rest).split(b'\n')
+            rest = b''
+            if start > 0:
+                rest = lines.pop(0)     # may be the end of a record
+            for line in reversed(lines):
+                if since is not None:
+                    # every record starts with {"t":<ns>,
+                    try:
+                        t = int(line[5:line.index(b',')])
+                    except ValueError:
+                        continue
+                    if t <= since and journal_record(line):
+                        return
+                if name is not None and name not in line:
+                    continue
+                record = journal_record(line)
+                if record:
+                    yield record
+            end = start
+    return
+
+def journal_names(inode, offset):
+    # the names of the tasks changed since 'offset' in the journal with
+    # the given inode (None: there was no journal yet), and where the
+    # journal ends now, as (names, inode, end); None if the journal has
+    # been replaced or cut short since
+    try:
+        fd = open(os.path.join(dbs_repo(), JOURNAL), 'rb')
+    except FileNotFoundError:
+        if inode is not None:
+            return None
+        return (set(), None, 0)
+    with fd:
+        st = os.fstat(fd.fileno())
+        if inode is None:
+            offset = 0
+        elif st.st_ino != inode or st.st_size < offset:
+            return None
+        fd.seek(offset)
+        data = fd.read()
+    end = data.rfind(b'\n') + 1        # leave a record being written
+    names = set()
+    for line in data[:end].split(b'\n'):
+        record = journal_record(line)
+        if record:
+            names.add(record['name'])
+    return (names, st.st_ino, offset + end)
+
+def journal_record(line):
+    # a record from its journal line, or None if it is empty or was cut
+    # short by a crash
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def snapshot_mark():
+    # where the repo stands, as far as a snapshot cares: the index (and
+    # how often it has rescanned), and how far the journal goes
+    try:
+        st = os.stat(os.path.join(dbs_repo(), JOURNAL))
+        journal = (st.st_ino, st.st_size)
+    except FileNotFoundError:
+        journal = (None, 0)
+    return dbs_index().generation() + journal
+
+def snapshot_changes(mark):
+    # the names of the tasks changed since a snapshot was taken at
+    # 'mark', and the mark to use from now on; None if the snapshot
+    # can no longer be trusted because the repo changed behind our back
+    (epoch, resyncs, inode, offset) = mark
+    generation = dbs_index().generation()
+    if (epoch, resyncs) != generation:
+        return None
+    changed = journal_names(inode, offset)
+    if changed is None:
+        return None
+    (names, inode, end) = changed
+    return (names, generation + (inode, end))
+
+def snapshot_read():
+    # what snapshot_write() saved, or None if there is nothing usable
+    try:
+        with open(os.path.join(dbs_repo(), SNAPSHOT), 'rb') as fd:
+            data = marshal.loads(fd.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or \
+       data.get('version') != SNAPSHOT_VERSION or \
+       len(data.get('mark', ())) != 4:
+        return None
+    return data
+
+def snapshot_write(data):
+    # save a dict of plain values (and the mark from snapshot_mark() it
+    # goes with) for the next start; it is only a cache, so no fsync
+    data['version'] = SNAPSHOT_VERSION
+    path = os.path.join(dbs_repo(), SNAPSHOT)
+    tmppath = '%s.%d' % (path, os.getpid())
+    with open(tmppath, 'wb') as fd:
+        marshal.dump(data, fd)
+    os.replace(tmppath, path)
+    return
+
+def lazy_task(name, task, state, project, priority, nnotes, where):
+    # a Task from a snapshot or a summary: everything but the notes,
+    # which are only read in when something asks for them (see
+    # Task.__getattr__)
+    t = Task.__new__(Task)
+    t.__dict__.update(name=name, task=task, state=state, project=project,
+                      priority=priority, nnotes=nnotes, where=where,
+                      saved=None, old_notes=None)
+    return t
+
 def task_name_exists(name):
+    # the state the task is in, or None if there is no such task
     if not name:
         return None
 
-    cname = task_canonical_name(name)
-    for state in [ACTIVE, OPEN, DONE, DELETED]:
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-            if cname in filenames:
-                return os.path.join(dbs_repo(), state, cname)
-    return None
+    return dbs_store().locate(task_canonical_name(name))
 
 def task_canonical_name(name):
     if not name:
@@ -501,3 +3074,98 @@ def task_canonical_name(name):
 
     return f'{int(name):08d}'
 
+
+def read_file(path):
+    # all of a (small) file as bytes: a plain os.read() has less to do
+    # than open(), and beats a mmap at this size
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = [ os.read(fd, READ_SIZE) ]
+        while len(chunks[-1]) == READ_SIZE:
+            chunks.append(os.read(fd, READ_SIZE))
+    finally:
+        os.close(fd)
+    return b''.join(chunks)
+
+def task_text(data, pos, endpos):
+    # data[pos:endpos] as (data, pos, endpos) with every line ending in
+    # '\n': as in a file opened as text, a lone '\r' ends a line too
+    if endpos is None:
+        endpos = len(data)
+    if data.find(b'\r', pos, endpos) >= 0:
+        data = data[pos:endpos].replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        (pos, endpos) = (0, len(data))
+    return (data, pos, endpos)
+
+def task_lines(data, pos, endpos):
+    # (field, rest) for each line of data[pos:endpos], with RE_LINE
+    (data, pos, endpos) = task_text(data, pos, endpos)
+    lines = RE_LINE.findall(data, pos, endpos)
+    if endpos == pos or data[endpos - 1] == ord('\n'):
+        lines.pop()                 # nothing after the last newline
+    return lines
+
+def field_value(key, value):
+    # what a task field says, from the bytes after 'Key:'; any other
+    # 'Key:' in it goes too, as it always has
+    text = value.decode()
+    if b':' in value and key + b':' in value:
+        text = text.replace(key.decode() + ':', '')
+    return text.strip()
+
+def task_fields(data, pos=0, endpos=None):
+    # (task, state, project, priority, notes) from the bytes of a task,
+    # in a single pass of RE_LINE; data may be anything re can search,
+    # a mmap of a whole log segment included.  Only what is kept gets
+    # decoded: the last line for each field, and the notes.  Lines that
+    # are not fields are ignored; see task_errors() for those.
+    fields = {}
+    found = []
+    for (key, value) in task_lines(data, pos, endpos):
+        if key == b'Note':
+            found.append(field_value(key, value))
+        elif key:
+            fields[key] = value
+    ret = [ field_value(ii, fields[ii]) if ii in fields else default
+            for (ii, default) in TASK_FIELDS ]
+    ret.append(found)
+    return ret
+
+def task_summary(data, pos=0, endpos=None):
+    # (task, state, project, priority, number of notes) from the bytes of
+    # a task, the same as task_fields() but for the notes, which are only
+    # counted.  With RE_SUMMARY there is no loop over the lines here: the
+    # last line for each field wins in the dict, and the notes are (b'',
+    # b'') rows.
+    (data, pos, endpos) = task_text(data, pos, endpos)
+    lines = RE_SUMMARY.findall(data, pos, endpos)
+    fields = dict(lines)
+    ret = [ field_value(ii, fields[ii]) if ii in fields else default
+            for (ii, default) in TASK_FIELDS ]
+    ret.append(lines.count((b'', b'')))
+    return ret
+
+def task_errors(data, pos=0, endpos=None):
+    # what is wrong with the bytes of a task, '' if nothing: the last bad
+    # field, or else the first line that is not a field at all.  The
+    # values checked are the ones task_fields() would give.
+    ret = ''
+    linenum = 0
+    for (key, value) in task_lines(data, pos, endpos):
+        linenum += 1
+        if not key:
+            k = value.decode().strip().split(':')[0]
+            ret = '? unknown keyword "%s" at line %d' % (k, linenum)
+            break
+        elif key in (b'Name', b'Note'):
+            continue
+        v = field_value(key, value)
+        if key == b'Task' and not v:
+            ret = '? no task description at line %d' % (linenum)
+        elif key == b'Project' and not v:
+            ret = '? no project name at line %d' % (linenum)
+        elif key == b'State' and v not in ALLOWED_STATES:
+            ret = '? unknown state "State" at line %d' % (linenum)
+        elif key == b'Priority' and v not in [HIGH, MEDIUM, LOW]:
+            ret = '? unknown priority "Priority" at line %d' % (linenum)
+    return ret
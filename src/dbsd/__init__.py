@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, Al Stone <ahs3@ahs3.net>
+#
+#       dbs == dain-bread simple, a todo list for minimalists
+#
+# dbsd keeps the index, the task cache and the name map open between
+# commands and runs dbs commands sent to it over a Unix socket; dbs uses
+# it whenever it is running.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import contextlib
+import io
+import json
+import os
+import os.path
+import signal
+import socket
+import sys
+import traceback
+
+import dbs
+from dbs_task import *
+
+#-- globals
+SERVER = None
+
+#-- helper functions
+def usage():
+    print("usage: dbsd [start | stop | status]")
+    print("   start  => serve dbs commands until stopped (the default)")
+    print("   stop   => ask a running dbsd to exit")
+    print("   status => report whether dbsd is running")
+    return
+
+def run(request):
+    # run one dbs command, capturing what it prints
+    if request.get('config') != dbs_config_name():
+        # a different user setup; the client has to do it itself
+        return { 'fallback': True }
+
+    os.environ['COLUMNS'] = str(request['columns'])
+    os.environ['LINES'] = str(request['lines'])
+    out = io.StringIO()
+    err = io.StringIO()
+    status = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            dbs.run_command(request['argv'])
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+    return { 'status': status, 'stdout': out.getvalue(),
+             'stderr': err.getvalue() }
+
+def serve(conn):
+    global SERVER
+
+    # the request, then the go ahead once we have said we have it (see
+    # dbsd_request()); a client that is slow about either is dropped, so
+    # that it does not hold up everybody else
+    conn.settimeout(DBSD_TIMEOUT)
+    fd = conn.makefile('rb')
+    try:
+        request = json.loads(fd.readline())
+        conn.sendall((json.dumps({ 'ready': True }) + '\n').encode())
+        if not json.loads(fd.readline()).get('go'):
+            return
+    except (OSError, ValueError, AttributeError):
+        return
+    finally:
+        fd.close()
+
+    if request.get('stop'):
+        reply = { 'status': 0 }
+        SERVER.close()
+        SERVER = None
+    elif request.get('ping'):
+        reply = { 'status': 0, 'pid': os.getpid() }
+    else:
+        reply = run(request)
+
+    try:
+        conn.sendall((json.dumps(reply) + '\n').encode())
+    except OSError:
+        pass
+    return
+
+def stop(signum, frame):
+    sys.exit(0)
+
+def start():
+    global SERVER
+
+    dbs.do_init([])
+    path = dbs_socket_name()
+    if dbsd_request({ 'ping': True }):
+        print("? dbsd is already running")
+        sys.exit(1)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)             # left over from a dbsd that died
+
+    SERVER = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    SERVER.bind(path)
+    os.chmod(path, 0o600)
+    SERVER.listen(16)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, stop)
+    try:
+        while SERVER:
+            (conn, addr) = SERVER.accept()
+            try:
+                serve(conn)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if SERVER:
+            SERVER.close()
+        if os.path.exists(path):
+            os.remove(path)
+    return
+
+#-- main
+def dbsd():
+    cmd = 'start'
+    if len(sys.argv) > 1:
+        cmd = sys.argv[1]
+
+    if cmd == 'start':
+        start()
+    elif cmd == 'stop':
+        dbs.do_init([])
+        if not dbsd_request({ 'stop': True }):
+            print("dbsd is not running")
+    elif cmd == 'status':
+        dbs.do_init([])
+        reply = dbsd_request({ 'ping': True })
+        if reply:
+            print("dbsd is running, pid %d" % reply['pid'])
+        else:
+            print("dbsd is not running")
+            sys.exit(1)
+    else:
+        usage()
+        sys.exit(1)
+
+    return
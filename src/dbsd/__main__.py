@@ -0,0 +1,4 @@
+from dbsd import dbsd
+
+if __name__ == '__main__':
+	dbsd()
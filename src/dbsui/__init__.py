@@ -6,8 +6,10 @@
 # SPDX-License-Identifier: GPL-2.0-only
 #
 
+import bisect
 import collections
 import curses
+import gc
 from curses import panel
 
 import dbs_task
@@ -31,7 +33,12 @@ HELP_PREFIX = re.compile('^help_')
 ACTIVE_PROJECTS = collections.OrderedDict()
 ACTIVE_TASKS = collections.OrderedDict()
 ALL_PROJECTS = collections.OrderedDict()
-ALL_TASKS = collections.OrderedDict()
+ALL_TASKS = {}                  # name => Task; a TaskTable once loaded
+MODEL = None
+LOADER = None                   # loads the tasks a piece at a time
+LOADED = 0
+DRAWN = {}                      # window => { line number: what is on it }
+REDRAW_ALL = False              # the terminal was used by someone else
 
 current_project = ''
 current_task = ''
@@ -68,6 +75,7 @@ DELETED_TASKS_TRAILER = ' Deleted Tasks: %d || j: Next   k: Previous   q: Quit '
 DONE_TASKS_TRAILER    = ' Done Tasks: %d || j: Next   k: Previous   q: Quit '
 HELP_HEADER           = 'Help || j: NextLine   k: PrevLine  q: Quit'
 OPEN_TASKS_TRAILER    = ' Open Tasks: %d || j: Next   k: Previous   q: Quit '
+SEARCH_TASKS_TRAILER  = ' Found: %d || j: Next   k: Previous   q: Quit '
 MAIN_HEADER           = 'dbs || q: Quit   s: Show Task   ?: Help'
 RECAP_HEADER          = 'Recap || j: NextLine   k: PrevLine  q: Quit'
 SHOW_HEADER           = 'Show Task || j: NextLine   k: PrevLine  q: Quit'
@@ -78,6 +86,9 @@ VERSION_TEXT        = 'dbsui, v' + dbs_task.VERSION + ' '
 
 DBG = None
 PROJECT_WIDTH = 20
+KEY_TIMEOUT = 500               # ms to wait for a key before checking the repo
+CHECK_MODEL = 'DBSUI_CHECK' in os.environ   # check every change against the repo
+LOAD_CHUNK = 500                # tasks to load between looks at the keyboard
 
 #-- classes
 class DbsLine:
@@ -91,6 +102,7 @@ class DbsLine:
         self.screen = screen
         self.window = None
         self.panel = None
+        self.frame = None           # what the window shows right now
         return
     
     def create(self):
@@ -113,6 +125,7 @@ class DbsLine:
                   (self.name, height, width, y, x))
         self.window.clear()
         self.page_height = height
+        self.frame = None
         return
 
     def refresh(self):
@@ -121,6 +134,7 @@ class DbsLine:
         return
 
     def resize(self, screen):
+        DRAWN.pop(self.window, None)
         del self.panel
         del self.window
         self.screen = screen
@@ -134,6 +148,20 @@ class DbsLine:
     def get_text(self):
         return self.text
 
+    def changed(self, frame):
+        # is frame, all that decides what the window shows, any different
+        # from what was drawn last time?
+        if frame == self.frame:
+            return False
+        self.frame = frame
+        return True
+
+    def invalidate(self):
+        # the window no longer shows what we drew; draw all of it again
+        self.frame = None
+        forget_lines(self.window)
+        return
+
 
 class DbsPanel(DbsLine):
     def __init__(self, name, screen, content_cb):
@@ -158,9 +186,11 @@ class DbsPanel(DbsLine):
         return
 
     def show(self):
-        # show the window and content
+        # show the window and content; the windows share the screen, so
+        # whatever was on top may have drawn over this one
         self.hidden = False
         self.panel.show()
+        self.invalidate()
         return
 
     def next(self):
@@ -284,6 +314,8 @@ class DbsHeader(DbsPanel):
         return
 
     def refresh(self):
+        if not self.changed(self.text):
+            return
         self.content_cb(self.screen, self.window, self.text)
         DBG.write('DbsHeader.refresh: msg = "%s"' % (self.text.strip()))
         return
@@ -308,6 +340,8 @@ class DbsTrailer(DbsPanel):
         return
 
     def refresh(self):
+        if not self.changed((self.text, basic_counts(), LOADER and LOADED)):
+            return
         self.content_cb(self.screen, self.window, self.text)
         return
 
@@ -324,6 +358,8 @@ class DbsCli(DbsPanel):
         return
 
     def refresh(self):
+        if not self.changed(self.text):
+            return
         self.content_cb(self.screen, self.window, self.text)
         return
 
@@ -337,7 +373,7 @@ class DbsCli(DbsPanel):
         if not prompt:
             prompt = '> '
         win = self.window
-        win.clear()
+        self.invalidate()
         curses.curs_set(2)
         curses.echo()
         win.move(0, 0)
@@ -351,6 +387,7 @@ class DbsCli(DbsPanel):
 
         curses.curs_set(0)
         curses.noecho()
+        self.invalidate()
         return txt
 
 
@@ -377,10 +414,12 @@ class DbsProjects(DbsPanel):
             return
 
         start = self.current_page * (self.page_height - 1)
-        plist = self.content[start:]
+        plist = self.content[start:start+self.page_height]
+        current_project = self.current_project
+        if not self.changed((plist, current_project)):
+            return
         DBG.write('DbsProject::refresh: "%s", first, last = %d, %d' %
                   (current_project, start, len(self.content)-1))
-        current_project = self.current_project
         self.content_cb(self.screen, self.window, plist)
         return
 
@@ -406,6 +445,24 @@ class DbsProjects(DbsPanel):
             current_project = self.current_project
         return
 
+    def repopulate(self):
+        # populate again after a change on disk, staying on the same
+        # project if it is still around
+        global current_project
+
+        self.populate()
+        names = [ ii.split('\t')[0] for ii in self.content ]
+        if self.current_project not in names:
+            self.current_project = ''
+            if len(names) > 0:
+                self.current_project = names[0]
+        self.current_index = 0
+        if self.current_project:
+            self.current_index = names.index(self.current_project)
+        self.current_page = self.current_index // (self.page_height - 1)
+        current_project = self.current_project
+        return
+
     def next_project(self):
         global current_project
 
@@ -451,17 +508,17 @@ class DbsTasks(DbsPanel):
         global current_task
         global DBG
 
-        if not self.content:
-            return 
-
         if self.hidden:
-            self.current_index = 0
-            self.current_page = 0
-            current_task = self.content[self.current_index].split('\t')[0]
+            if self.content:
+                self.current_index = 0
+                self.current_page = 0
+                current_task = self.content[self.current_index].split('\t')[0]
             return
 
         start = self.current_page * (self.page_height - 1)
-        plist = self.content[start:]
+        plist = self.content[start:start+self.page_height]
+        if not self.changed((plist, current_task)):
+            return
         DBG.write('DbsTasks::refresh: first, last, height = %d, %d, %d' %
                   (start, len(self.content)-1, self.page_height))
         self.content_cb(self.screen, self.window, plist)
@@ -501,6 +558,24 @@ class DbsTasks(DbsPanel):
         self.current_page = 0
         return
 
+    def repopulate(self):
+        # populate again after a change on disk, staying on the same task
+        # if it is still around
+        global current_task
+
+        keep = self.current_task
+        self.content = []
+        self.current_task = ''
+        current_task = ''
+        self.populate()
+        names = [ ii.split('\t')[0] for ii in self.content ]
+        if keep in names:
+            self.current_index = names.index(keep)
+            self.current_page = self.current_index // (self.page_height - 1)
+            self.current_task = keep
+            current_task = keep
+        return
+
     def next_task(self):
         global current_task
 
@@ -566,7 +641,10 @@ class DbsList(DbsPanel):
         start = self.current_page * (self.page_height - 1)
         if start > len(self.content) - 1:
             start = len(self.content) - 1
-        plist = self.content[int(start):]
+        start = int(start)
+        plist = self.content[start:start+self.page_height]
+        if not self.changed((plist, current_line)):
+            return
         DBG.write('DbsList::refresh: first, last = %d, %d' %
                   (start, len(self.content)-1))
         self.content_cb(self.screen, self.window, plist)
@@ -575,7 +653,7 @@ class DbsList(DbsPanel):
     def set_content(self, clist):
         global DBG, current_line
 
-        self.window.clear()
+        self.invalidate()
         self.content = clist
         self.current_index = 0
         self.current_page = 0
@@ -661,6 +739,346 @@ class Debug:
         self.fd.close()
         return
 
+
+class TaskTable(dict):
+    # name => Task, except that a task restored from a snapshot is only
+    # its row number in the snapshot's columns (see TaskModel.save())
+    # until it is first looked up
+    def __init__(self):
+        dict.__init__(self)
+        self.columns = {}
+        self.counted = {}           # the model's; see TaskModel.counted
+        return
+
+    def __getitem__(self, name):
+        t = dict.__getitem__(self, name)
+        if type(t) is int:
+            c = self.columns
+            t = dbs_task.lazy_task(name, c['task'][t], c['state'][t],
+                    c['project'][t], c['priority'][t], c['notes'][t],
+                    c['where'][t])
+            self.counted[name] = self.row(name)
+            dict.__setitem__(self, name, t)
+        return t
+
+    def row(self, name):
+        # how a task still in the snapshot was counted: (project,
+        # priority, state)
+        ii = dict.__getitem__(self, name)
+        c = self.columns
+        return (c['project'][ii], c['priority'][ii], c['where'][ii])
+
+class TaskModel:
+    # what the panels are built from: every task by name, the counts by
+    # project, and the open and active tasks of each project by priority;
+    # single task changes are applied in place.  What it holds can be
+    # saved as a snapshot for the next start to begin from.
+    def __init__(self, tasks, projects, active):
+        self.tasks = tasks          # name => Task
+        self.projects = projects    # project => counts by state and priority
+        self.active = active        # project => counts, and tasks by priority
+                                    # (name => Task, or see TaskTable)
+        self.counted = {}           # name => (project, priority, state),
+                                    # once it is more than a snapshot row
+        self.names = {}             # state, or '' for all => task names
+        self.unsorted = set()       # which of those need sorting first
+        self.mark = None            # see dbs_task.snapshot_mark()
+        self.changed = False        # since the snapshot was read or saved
+        return
+
+    def build(self):
+        # start over from the repo, all at once
+        for ii in self.load():
+            pass
+        return
+
+    def load(self):
+        # start over from the repo, a piece at a time: the counts first,
+        # then the active and open tasks, then the done and deleted ones;
+        # yields how many tasks have been loaded after each piece
+        self.tasks.clear()
+        self.projects.clear()
+        self.active.clear()
+        self.counted.clear()
+        self.names = { '':[], ACTIVE:[], OPEN:[], DONE:[], DELETED:[] }
+        self.unsorted = set()
+        self.mark = dbs_task.snapshot_mark()
+        self.changed = True
+
+        # the per-project counts come from the index, not from recounting
+        summaries = dbs_task.project_summaries(dbs_task.ALLOWED_STATES)
+        for ii in sorted(summaries):
+            self.projects[ii] = summaries[ii]
+
+        # isolate the projects with actual activity
+        for ii in self.projects:
+            p = self.projects[ii]
+            if p[ACTIVE] + p[OPEN] > 0:
+                self.active[ii] = { ACTIVE:p[ACTIVE], OPEN:p[OPEN],
+                                    HIGH:{}, MEDIUM:{}, LOW:{} }
+        yield 0
+
+        # get every known task, attaching the active ones to the active
+        # projects by priority
+        count = 0
+        for states in [[ACTIVE, OPEN], [DONE, DELETED]]:
+            for t in dbs_task.scan_tasks(states):
+                name = t.get_name()
+                if name in self.tasks:
+                    continue
+                self.tasks[name] = t
+                self.counted[name] = (t.get_project(), t.get_priority(),
+                                      counted_state(t))
+                self.add_name(name, counted_state(t))
+                s = t.get_state()
+                if t.get_project() in self.active and \
+                   (s == ACTIVE or s == OPEN):
+                    self.active[t.get_project()][t.get_priority()][name] = t
+                count += 1
+                if count % LOAD_CHUNK == 0:
+                    yield count
+            yield count
+        return
+
+    def restore(self):
+        # start from the last snapshot, then read in again only the tasks
+        # the journal says were changed since; False if there is no
+        # snapshot, or it cannot be trusted any more.  The garbage
+        # collector has nothing to find in a snapshot, but would look
+        # through all of it several times while it is being read in.
+        gc.disable()
+        try:
+            data = dbs_task.snapshot_read()
+            if not data:
+                return False
+            changes = dbs_task.snapshot_changes(data['mark'])
+            if changes is None:
+                return False
+            (changed, self.mark) = changes
+
+            names = data['names']
+            columns = data['columns']
+            for ii in columns:
+                if len(columns[ii]) != len(names['']):
+                    return False
+            self.counted.clear()
+            self.tasks.clear()
+            self.tasks.columns = columns
+            self.tasks.counted = self.counted
+            rows = dict(zip(names[''], range(len(names['']))))
+            self.tasks.update(rows)
+            self.projects.clear()
+            self.projects.update(data['projects'])
+            self.active.clear()
+            for ii in self.projects:
+                p = self.projects[ii]
+                if p[ACTIVE] + p[OPEN] > 0:
+                    self.active[ii] = { ACTIVE:p[ACTIVE], OPEN:p[OPEN],
+                                        HIGH:{}, MEDIUM:{}, LOW:{} }
+            self.names = names
+            self.unsorted = set()
+            project = columns['project']
+            priority = columns['priority']
+            for name in data['active']:
+                ii = rows[name]
+                if project[ii] in self.active:
+                    self.active[project[ii]][priority[ii]][name] = ii
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False            # damaged; load() will start over
+        finally:
+            gc.enable()
+
+        self.changed = False
+        for name in changed:
+            self.update(name, dbs_task.dbs_store().get(name))
+        return True
+
+    def save(self):
+        # write out a snapshot for restore(): the task names by state,
+        # the tasks as columns in the order of all of the names, and
+        # which of them are active or open (going by the task, like
+        # load(), which the state it is kept under need not agree with)
+        columns = { 'task':[], 'state':[], 'project':[], 'priority':[],
+                    'notes':[], 'where':[] }
+        names = {}
+        for ii in self.names:
+            names[ii] = self.sorted_names(ii)
+        for name in names['']:
+            t = dict.__getitem__(self.tasks, name)
+            if type(t) is int:
+                for ii in columns:
+                    columns[ii].append(self.tasks.columns[ii][t])
+                continue
+            columns['task'].append(t.get_task())
+            columns['state'].append(t.get_state())
+            columns['project'].append(t.get_project())
+            columns['priority'].append(t.get_priority())
+            columns['notes'].append(t.note_count())
+            columns['where'].append(self.counted[name][2])
+        active = [ name for (name, state) in zip(names[''], columns['state'])
+                   if state == ACTIVE or state == OPEN ]
+        dbs_task.snapshot_write({ 'mark':self.mark, 'names':names,
+                                  'columns':columns, 'active':active,
+                                  'projects':dict(self.projects) })
+        self.changed = False
+        return
+
+    def forget(self, name):
+        # take a task out, as it was when it was counted; the Task itself
+        # may have been changed since
+        if name not in self.tasks:
+            return
+        if name in self.counted:
+            (project, priority, state) = self.counted.pop(name)
+        else:
+            (project, priority, state) = self.tasks.row(name)
+        del self.tasks[name]
+        self.drop_name(name, state)
+        if project not in self.projects:
+            return
+        p = self.projects[project]
+        p[priority] -= 1
+        p[state] -= 1
+        if project in self.active:
+            ap = self.active[project]
+            ap[priority].pop(name, None)
+            if p[ACTIVE] + p[OPEN] > 0:
+                ap[ACTIVE] = p[ACTIVE]
+                ap[OPEN] = p[OPEN]
+            else:
+                del self.active[project]
+        if p[HIGH] + p[MEDIUM] + p[LOW] == 0:
+            del self.projects[project]
+        return
+
+    def learn(self, t):
+        # put a task in, as it is now
+        name = t.get_name()
+        project = t.get_project()
+        self.tasks[name] = t
+        self.counted[name] = (project, t.get_priority(), counted_state(t))
+        self.add_name(name, counted_state(t))
+        if project not in self.projects:
+            self.projects[project] = { HIGH:0, MEDIUM:0, LOW:0, ACTIVE:0,
+                                       OPEN:0, DONE:0, DELETED:0 }
+        p = self.projects[project]
+        p[t.get_priority()] += 1
+        p[counted_state(t)] += 1
+        if p[ACTIVE] + p[OPEN] > 0 and project not in self.active:
+            self.active[project] = { HIGH:{}, MEDIUM:{}, LOW:{} }
+        if project in self.active:
+            ap = self.active[project]
+            ap[ACTIVE] = p[ACTIVE]
+            ap[OPEN] = p[OPEN]
+            if t.get_state() == ACTIVE or t.get_state() == OPEN:
+                ap[t.get_priority()][name] = t
+        return
+
+    def add_name(self, name, state):
+        # names mostly come in order, so only sort when they do not
+        for ii in ['', state]:
+            names = self.names[ii]
+            if names and names[-1] > name:
+                self.unsorted.add(ii)
+            names.append(name)
+        return
+
+    def drop_name(self, name, state):
+        for ii in ['', state]:
+            names = self.names[ii]
+            if ii in self.unsorted:
+                names.remove(name)
+            else:
+                del names[bisect.bisect_left(names, name)]
+        return
+
+    def sorted_names(self, state=''):
+        # the names of the tasks in a state, or of all of them, in order
+        if state in self.unsorted:
+            self.names[state].sort()
+            self.unsorted.discard(state)
+        return self.names[state]
+
+    def update(self, name, t=None):
+        # replace what we know of a task with t, or drop it if there
+        # is no t; returns the projects that were affected
+        projects = set()
+        if name in self.counted:
+            projects.add(self.counted[name][0])
+        self.changed = True
+        self.forget(name)
+        if t:
+            projects.add(t.get_project())
+            self.learn(t)
+        if CHECK_MODEL:
+            for ii in self.check():
+                DBG.write('check: %s: %s' % (name, ii))
+        return projects
+
+    def check(self):
+        # compare with a model built from scratch; returns what differs.
+        # The index has to catch up first with changes made outside of
+        # dbs, as build_task_info() does
+        dbs_task.dbs_revalidate()
+        fresh = TaskModel({}, {}, {})
+        fresh.build()
+        diffs = []
+        for ii in sorted(set(self.tasks) | set(fresh.tasks)):
+            if ii not in fresh.tasks:
+                diffs.append('task %s should not be there' % ii)
+            elif ii not in self.tasks:
+                diffs.append('task %s is missing' % ii)
+            else:
+                mine = self.tasks[ii]
+                theirs = fresh.tasks[ii]
+                if mine.header() != theirs.header() or \
+                   mine.note_count() != theirs.note_count():
+                    diffs.append('task %s differs' % ii)
+        for ii in sorted(set(self.projects) | set(fresh.projects)):
+            if dict(self.projects.get(ii, {})) != \
+               dict(fresh.projects.get(ii, {})):
+                diffs.append('project %s counts differ' % ii)
+        for ii in sorted(set(self.active) | set(fresh.active)):
+            mine = self.active.get(ii, {})
+            theirs = fresh.active.get(ii, {})
+            for jj in [ACTIVE, OPEN]:
+                if mine.get(jj) != theirs.get(jj):
+                    diffs.append('project %s %s count differs' % (ii, jj))
+            for jj in [HIGH, MEDIUM, LOW]:
+                if set(mine.get(jj, {})) != set(theirs.get(jj, {})):
+                    diffs.append('project %s %s tasks differ' % (ii, jj))
+        for ii in fresh.names:
+            if self.sorted_names(ii) != fresh.sorted_names(ii):
+                diffs.append('names in "%s" differ' % ii)
+        return diffs
+
+
+class TaskLines:
+    # the lines of a task list, made only for the lines that get shown;
+    # DbsList takes it like any other list of lines
+    def __init__(self, names, line_cb, found=None):
+        self.names = names          # task names, in order
+        self.line_cb = line_cb      # Task => line
+        self.found = found          # name => Task, for those not loaded yet
+        if found is None:
+            self.found = {}
+        return
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self.line(ii) for ii in self.names[index] ]
+        return self.line(self.names[index])
+
+    def line(self, name):
+        if name in ALL_TASKS:
+            return self.line_cb(ALL_TASKS[name])
+        if name in self.found:
+            return self.line_cb(self.found[name])
+        return '%8d  (gone)' % int(name)
+
 #-- command functions
 def add_task(tname):
     global DBG, ALL_TASKS, current_project
@@ -690,6 +1108,7 @@ def add_task(tname):
     if not editor:
         editor = 'vi'
     result = subprocess.run([editor, tpath])
+    redraw_all()
     os.lseek(tfd, 0, 0)
     after = os.read(tfd, os.fstat(tfd).st_size)
     os.close(tfd)
@@ -708,6 +1127,7 @@ def add_task(tname):
         t.set_fields(after_edit)
         t.add_note('added')
         t.write()
+        update_task_info(t)
 
     DBG.write('add_task: %s = %d [%s]' % (task_name, len(after_edit), ret))
     return ret
@@ -740,6 +1160,7 @@ def log_task(tname):
     if not editor:
         editor = 'vi'
     result = subprocess.run([editor, tpath])
+    redraw_all()
     os.lseek(tfd, 0, 0)
     after = os.read(tfd, os.fstat(tfd).st_size)
     os.close(tfd)
@@ -758,6 +1179,7 @@ def log_task(tname):
         t.set_fields(after_edit)
         t.add_note('logged')
         t.write()
+        update_task_info(t)
 
     DBG.write('log_task: %s = %d [%s]' % (task_name, len(after_edit), ret))
     return ret
@@ -768,13 +1190,12 @@ def mark_active(raw_task):
     tname = dbs_task.task_canonical_name(raw_task)
     if tname in ALL_TASKS:
         t = ALL_TASKS[tname]
-        fullpath = dbs_task.task_name_exists(tname)
-        old_state = t.get_state()
-        t.set_state(ACTIVE)
         t.add_note("marked active")
-        dbs_task.put_task(t)
-        if old_state != ACTIVE:
-            os.remove(fullpath)
+        if t.get_state() != ACTIVE:
+            t.move(ACTIVE)
+        else:
+            dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
@@ -787,13 +1208,12 @@ def mark_deleted(raw_task):
     tname = dbs_task.task_canonical_name(raw_task)
     if tname in ALL_TASKS:
         t = ALL_TASKS[tname]
-        fullpath = dbs_task.task_name_exists(tname)
-        old_state = t.get_state()
-        t.set_state(DELETED)
         t.add_note("deleted")
-        dbs_task.put_task(t)
-        if old_state != DELETED:
-            os.remove(fullpath)
+        if t.get_state() != DELETED:
+            t.move(DELETED)
+        else:
+            dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
@@ -805,13 +1225,12 @@ def mark_done(raw_task):
     tname = dbs_task.task_canonical_name(raw_task)
     if tname in ALL_TASKS:
         t = ALL_TASKS[tname]
-        fullpath = dbs_task.task_name_exists(tname)
-        old_state = t.get_state()
-        t.set_state(DONE)
         t.add_note("marked done")
-        dbs_task.put_task(t)
-        if old_state != DONE:
-            os.remove(fullpath)
+        if t.get_state() != DONE:
+            t.move(DONE)
+        else:
+            dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
@@ -833,6 +1252,7 @@ def mark_higher(raw_task):
         t.set_priority(pri)
         t.add_note("upped priority")
         dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
@@ -844,13 +1264,12 @@ def mark_inactive(raw_task):
     tname = dbs_task.task_canonical_name(raw_task)
     if tname in ALL_TASKS:
         t = ALL_TASKS[tname]
-        fullpath = dbs_task.task_name_exists(tname)
-        old_path = t.get_state()
-        t.set_state(OPEN)
         t.add_note("marked inactive")
-        dbs_task.put_task(t)
-        if old_state != OPEN:
-            os.remove(fullpath)
+        if t.get_state() != OPEN:
+            t.move(OPEN)
+        else:
+            dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
@@ -872,29 +1291,20 @@ def mark_lower(raw_task):
         t.set_priority(pri)
         t.add_note("upped priority")
         dbs_task.put_task(t)
+        update_task_info(t)
     else:
         return ('? no such task: %d' % int(raw_task))
 
     return
 
 def refresh_recap(days):
-    if int(days) > int(DAYS_LIMIT):
-        return ("? no, you really don't want more than %d days worth." %
-               int(days))
-
     current_time = time.time()
     elapsed_time = int(days) * 3600 * 24
+    since = int((current_time - elapsed_time) * 1e9)
 
-    fullpath = os.path.join(dbs_repo(), DONE)
     tasks = {}
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-        for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in dbs_task.scan_tasks(DONE, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     clist = []
     if len(tasks) < 1:
@@ -921,16 +1331,9 @@ def refresh_recap(days):
                     info += '%s' % tasks[ii].get_task()
                     clist.append(info)
 
-    fullpath = os.path.join(dbs_repo(), ACTIVE)
     tasks.clear()
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-        for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in dbs_task.scan_tasks(ACTIVE, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     clist.append("")
     if len(tasks) < 1:
@@ -957,16 +1360,9 @@ def refresh_recap(days):
                     info += '%s' % tasks[ii].get_task()
                     clist.append(info)
 
-    fullpath = os.path.join(dbs_repo(), OPEN)
     tasks.clear()
-    for (dirpath, dirnames, filenames) in os.walk(fullpath):
-        for ii in filenames:
-           file_time = os.path.getmtime(os.path.join(fullpath, ii))
-
-           if current_time - file_time < elapsed_time:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               tasks[ii] = t
+    for t in dbs_task.scan_tasks(OPEN, since=since, summary=True):
+        tasks[t.get_name()] = t
 
     clist.append("")
     if len(tasks) < 1:
@@ -1031,6 +1427,9 @@ def help_r():
 def help_s():
     return ('TASK', 's', "Show the current task")
 
+def help_slash():
+    return ('TASK', '/', "Search task text and notes")
+
 #-- list help messages
 def help_ctrl_l_a():
     return ('LIST', 'ctrl-L a', "List all active tasks")
@@ -1087,78 +1486,141 @@ def help_help():
     
 #-- helper functions
 def basic_counts():
-    global ALL_TASKS, ALL_PROJECTS
+    global ALL_PROJECTS
 
     tasks = 0
     projects = 0
     active = 0
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_state() == ACTIVE:
-            active += 1
-        if t.get_state() != DELETED:
-            tasks += 1
-
     for ii in ALL_PROJECTS:
         p = ALL_PROJECTS[ii]
+        active += p[ACTIVE]
+        tasks += p[ACTIVE] + p[OPEN] + p[DONE]
         if p[ACTIVE] + p[OPEN] > 0:
             projects += 1
 
     return (projects, active, tasks)
 
 def build_task_info():
-    global ALL_TASKS, ALL_PROJECTS
-    global ACTIVE_PROJECTS
+    global ALL_TASKS, ALL_PROJECTS, ACTIVE_PROJECTS, MODEL, LOADER
     global current_task, current_project
 
-    ALL_TASKS.clear()
-    ALL_PROJECTS.clear()
-    ACTIVE_PROJECTS.clear()
-
-    # get every known task
-    for state in dbs_task.ALLOWED_STATES:
-        fullpath = os.path.join(dbs_repo(), state)
-        for (dirpath, dirnames, filenames) in os.walk(fullpath):
-            for ii in filenames:
-               t = Task()
-               t.populate(os.path.join(fullpath, ii), ii)
-               if t.get_name() not in ALL_TASKS:
-                   ALL_TASKS[t.get_name()] = t
-                   proj = t.get_project()
-                   if proj not in ALL_PROJECTS:
-                       ALL_PROJECTS[proj] = { HIGH:0, MEDIUM:0, LOW:0, \
-                                             ACTIVE:0, OPEN:0, DONE:0,
-                                             DELETED:0 }
-                   pri = t.get_priority()
-                   ALL_PROJECTS[proj][pri] += 1
-                   s = t.get_state()
-                   ALL_PROJECTS[proj][s] += 1
-
-    # isolate the projects with actual activity
-    for ii in ALL_PROJECTS:
-        p = ALL_PROJECTS[ii]
-        if p[ACTIVE] + p[OPEN] > 0:
-            if ii not in ACTIVE_PROJECTS:
-                ACTIVE_PROJECTS[ii] = { ACTIVE:p[ACTIVE], OPEN:p[OPEN],
-                                        HIGH:[], MEDIUM:[], LOW:[] }
+    if not MODEL:
+        ALL_TASKS = TaskTable()
+        MODEL = TaskModel(ALL_TASKS, ALL_PROJECTS, ACTIVE_PROJECTS)
+
+    # we keep the index open, and others may have changed things since
+    dbs_task.dbs_revalidate()
+    LOADER = None
+    MODEL.build()
+    fix_current()
+    return
+
+def start_task_info():
+    # like build_task_info(), but starting from the last snapshot if it
+    # is still good; if not, only the counts are there on return and
+    # load_task_info() brings in the tasks while the UI is already up
+    global ALL_TASKS, ALL_PROJECTS, ACTIVE_PROJECTS, MODEL, LOADER, LOADED
+
+    if not MODEL:
+        ALL_TASKS = TaskTable()
+        MODEL = TaskModel(ALL_TASKS, ALL_PROJECTS, ACTIVE_PROJECTS)
+
+    dbs_task.dbs_revalidate()
+    if MODEL.restore():
+        LOADER = None
+        LOADED = len(ALL_TASKS)
+    else:
+        LOADER = MODEL.load()
+        LOADED = next(LOADER)
+    fix_current()
+    return
+
+def load_task_info(windows):
+    # load the next piece of the tasks, and show what came in
+    global LOADER, LOADED
+
+    try:
+        LOADED = next(LOADER)
+    except StopIteration:
+        LOADER = None
+        fix_current()
+        MODEL.save()            # so the next start need not do all this
+    DBG.write('load_task_info: %d' % LOADED)
+    windows[TASK_PANEL].repopulate()
+    return
+
+def save_task_info():
+    # leave a snapshot behind for the next start, if there is news
+    if MODEL and not LOADER and MODEL.changed:
+        MODEL.save()
+    return
+
+def fix_current():
+    global ALL_TASKS, ALL_PROJECTS, current_task, current_project
+
     if current_project not in ALL_PROJECTS:
         current_project = ''
-
-    # attach the active tasks to the active projects, by priority
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_project() not in ACTIVE_PROJECTS:
-            continue
-        s = t.get_state()
-        if s == ACTIVE or s == OPEN:
-            ACTIVE_PROJECTS[t.get_project()][t.get_priority()].append(t)
-        else:
-            continue
-    if current_task not in ALL_TASKS:
+    if current_task not in ALL_TASKS and not LOADER:
         current_task = ''
+    return
+
+def update_task_info(t):
+    # the UI changed t itself; no need to start over
+    global MODEL
+
+    if MODEL:
+        MODEL.update(t.get_name(), t)
+    return
+
+def counted_state(t):
+    # the index counts tasks by the state the store keeps them under
+    return t.where
+
+def apply_changes(names, windows):
+    # bring the task info up to date with tasks changed on disk, and
+    # populate again only the panels that show any of them
+    global MODEL, current_project, current_task
 
+    if names is None:
+        build_task_info()
+        windows[PROJ_PANEL].repopulate()
+        windows[TASK_PANEL].repopulate()
+        return
+
+    projects = set()
+    for ii in names:
+        name = dbs_task.task_canonical_name(ii)
+        t = dbs_task.dbs_store().get(name)
+        projects |= MODEL.update(name, t)
+
+    DBG.write('apply_changes: %s' % ' '.join(sorted(names)))
+    if projects:
+        windows[PROJ_PANEL].repopulate()
+    if current_project in projects or not current_task:
+        windows[TASK_PANEL].repopulate()
     return
 
+def get_key(stdscr, watcher, windows):
+    # wait for a key, keeping up with changes made to the repo meanwhile;
+    # None if something changed and the screen needs to be redrawn
+    while True:
+        if LOADER:
+            stdscr.timeout(0)
+        else:
+            stdscr.timeout(KEY_TIMEOUT)
+        try:
+            return stdscr.getkey()
+        except curses.error:
+            pass
+        if LOADER:
+            # changes made meanwhile wait for the watcher until we are done
+            load_task_info(windows)
+            return None
+        names = watcher.changes()
+        if names is None or len(names) > 0:
+            apply_changes(names, windows)
+            return None
+
 def build_text_attrs():
     global WHITE_ON_BLUE, BOLD_WHITE_ON_BLUE
     global PLAIN_TEXT, BOLD_PLAIN_TEXT
@@ -1199,27 +1661,61 @@ def build_text_attrs():
 
     return
 
+def draw_line(win, linenum, parts):
+    # put one line on a window, as (column, text, attrs) parts, unless
+    # the very same line is there already
+    lines = DRAWN.setdefault(win, {})
+    if lines.get(linenum) == parts:
+        return
+    if linenum in lines:
+        win.move(linenum, 0)
+        win.clrtoeol()
+    for (col, text, attrs) in parts:
+        win.addstr(linenum, col, text, attrs)
+    lines[linenum] = parts
+    return
+
+def clear_lines(win, linenum):
+    # blank whatever we drew from linenum on down
+    lines = DRAWN.setdefault(win, {})
+    for ii in sorted(lines):
+        if ii >= linenum:
+            win.move(ii, 0)
+            win.clrtoeol()
+            del lines[ii]
+    return
+
+def forget_lines(win):
+    # start over with a blank window; erase() rather than clear(), which
+    # would have the whole terminal repainted
+    if win:
+        win.erase()
+        DRAWN[win] = {}
+    return
+
 def refresh_header(screen, win, options):
     (sheight, swidth) = screen.getmaxyx()
     blanks = ''.ljust(swidth-1, ' ')
-    win.clear()
-    win.addstr(0, 0, blanks, BOLD_WHITE_ON_BLUE)
-    win.addstr(0, 0, options[0:swidth-1], BOLD_WHITE_ON_BLUE)
+    draw_line(win, 0, ((0, blanks, BOLD_WHITE_ON_BLUE),
+                       (0, options[0:swidth-1], BOLD_WHITE_ON_BLUE)))
     return
 
 def refresh_trailer(screen, win, msg):
     (height, width) = win.getmaxyx()
     dashes = ''.ljust(width-1, '-')
-    win.clear()
-    win.addstr(0, 0, dashes, BOLD_WHITE_ON_BLUE)
     if msg:
-        win.addstr(0, 3, msg, BOLD_WHITE_ON_BLUE)
+        draw_line(win, 0, ((0, dashes, BOLD_WHITE_ON_BLUE),
+                           (3, msg, BOLD_WHITE_ON_BLUE)))
     else:
         (project_count, active_count, task_count) = basic_counts()
-        win.addstr(0, 3, " dbs: %d projects, %d tasks, %d active " %
-                (project_count, task_count, active_count), BOLD_WHITE_ON_BLUE)
+        counts = " dbs: %d projects, %d tasks, %d active " % \
+                 (project_count, task_count, active_count)
         vers = ' v' + dbs_task.VERSION + ' '
-        win.addstr(0, width-len(vers)-4, vers, BOLD_WHITE_ON_BLUE)
+        if LOADER:
+            vers = ' loading: %d tasks ... ' % LOADED
+        draw_line(win, 0, ((0, dashes, BOLD_WHITE_ON_BLUE),
+                           (3, counts, BOLD_WHITE_ON_BLUE),
+                           (width-len(vers)-4, vers, BOLD_WHITE_ON_BLUE)))
     return
 
 def add_task_note(note):
@@ -1236,10 +1732,13 @@ def refresh_cli(screen, win, msg):
     if len(msg) > 0:
         prefix = msg.split(':')
         if prefix[0] == 'Add note':
-            win.addstr(0, 0, prefix[0]+': ', BOLD_RED_ON_BLACK)
-            win.addstr(0, len(prefix[0])+1, ' '.join(prefix[1:]), PLAIN_TEXT)
+            draw_line(win, 0, ((0, prefix[0]+': ', BOLD_RED_ON_BLACK),
+                               (len(prefix[0])+1, ' '.join(prefix[1:]),
+                                PLAIN_TEXT)))
         else:
-            win.addstr(0, 0, msg, BOLD_RED_ON_BLACK)
+            draw_line(win, 0, ((0, msg, BOLD_RED_ON_BLACK),))
+    else:
+        clear_lines(win, 0)
     return
 
 def refresh_projects(screen, win, lines):
@@ -1260,16 +1759,15 @@ def refresh_projects(screen, win, lines):
             attrs = BOLD_WHITE_ON_BLUE
         if pname == current_project:
             attrs = BOLD_WHITE_ON_RED
-        win.addstr(linenum, 0, blanks, attrs)
-        win.addstr(linenum, 0, ii, attrs)
-        win.addch(linenum, PROJECT_WIDTH-1, "|", BOLD_BLUE_ON_BLACK)
+        draw_line(win, linenum, ((0, blanks, attrs), (0, ii, attrs),
+                                 (PROJECT_WIDTH-1, "|", BOLD_BLUE_ON_BLACK)))
         # DBG.write('refresh_projects: ' + str(linenum))
         linenum += 1
         if linenum >= maxy - 1:
             return
 
     while linenum < maxy-1:
-        win.addch(linenum, PROJECT_WIDTH-1, "|", BOLD_BLUE_ON_BLACK)
+        draw_line(win, linenum, ((PROJECT_WIDTH-1, "|", BOLD_BLUE_ON_BLACK),))
         linenum += 1
 
     return
@@ -1291,13 +1789,12 @@ def get_current_task_list(project):
         return
 
     task_list = []
-    task_list = ACTIVE_PROJECTS[project][HIGH] + \
-                ACTIVE_PROJECTS[project][MEDIUM] + \
-                ACTIVE_PROJECTS[project][LOW]
+    for ii in [HIGH, MEDIUM, LOW]:
+        task_list += ACTIVE_PROJECTS[project][ii].keys()
     for ii in task_list:
-        t = ALL_TASKS[ii.get_name()]
-        if t.get_name() not in ACTIVE_TASKS and t.get_state() != DELETED:
-            ACTIVE_TASKS[t.get_name()] = ii
+        t = ALL_TASKS[ii]
+        if ii not in ACTIVE_TASKS and t.get_state() != DELETED:
+            ACTIVE_TASKS[ii] = t
 
     tlist = sorted(ACTIVE_TASKS.keys())
     if len(tlist) > 0:
@@ -1309,7 +1806,7 @@ def refresh_tasks(screen, win, lines):
     global ACTIVE_TASKS, current_task
 
     if not current_task:
-        return
+        lines = []
 
     maxy, maxx = win.getmaxyx()
     blanks = ''.ljust(maxx-1, ' ')
@@ -1329,13 +1826,13 @@ def refresh_tasks(screen, win, lines):
         if tname == current_task:
             attrs = BOLD_WHITE_ON_RED
         txt = "%8d  %4s  %1s  %s" % (int(info[0]), info[1], info[2], info[3])
-        win.addstr(linenum, 0, blanks, attrs)
-        win.addstr(linenum, 0, txt[0:maxx-1], attrs)
+        draw_line(win, linenum, ((0, blanks, attrs), (0, txt[0:maxx-1], attrs)))
         # DBG.write('refresh_tasks: <' + str(linenum) + '> ' + txt[0:maxx-1])
         linenum += 1
         if linenum >= maxy - 1:
             return
 
+    clear_lines(win, linenum)
     return
 
 def refresh_list(screen, win, lines):
@@ -1346,15 +1843,16 @@ def refresh_list(screen, win, lines):
     linenum = 0
     for ii in lines:
         attrs = PLAIN_TEXT
-        win.addstr(linenum, 0, blanks, attrs)
         if ii == current_line:
             attrs = BOLD_PLAIN_TEXT
-        win.addstr(linenum, 0, ii[0:maxx-1], attrs)
+        draw_line(win, linenum, ((0, blanks, PLAIN_TEXT),
+                                 (0, ii[0:maxx-1], attrs)))
         # DBG.write('refresh_list: <' + str(linenum) + '> ' + ii)
         linenum += 1
         if linenum >= maxy - 1:
             return
 
+    clear_lines(win, linenum)
     return
 
 def refresh_help():
@@ -1389,55 +1887,44 @@ def refresh_help():
 
     return clines
 
-def refresh_active_task_list():
-    global ALL_TASKS, current_project
+def task_line(t):
+    info = '%8d  ' % int(t.get_name())
+    info += '%7.7s  ' % t.get_project()
+    if t.note_count() > 0:
+        info += '[%.2d]  ' % t.note_count()
+    else:
+        info += '      '
+    info += '%1s  ' % t.get_priority()
+    info += '%s' % t.get_task()
+    return info
+
+def task_state_line(t):
+    info = '%8d  ' % int(t.get_name())
+    if t.get_state() == DELETED:
+        info += '%1.1s  ' % 'D'
+    else:
+        info += '%1.1s  ' % t.get_state()[0:1]
+    info += '%7.7s  ' % t.get_project()
+    if t.note_count() > 0:
+        info += '[%.2d]  ' % t.note_count()
+    else:
+        info += '      '
+    info += '%1s  ' % t.get_priority()
+    info += '%s' % t.get_task()
+    return info
 
-    task_list = collections.OrderedDict()
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_state() == ACTIVE:
-            if t.get_name() not in task_list:
-                task_list[t.get_name()] = t
+def task_list(state):
+    # the lines are only made for what is on the screen; the names are
+    # copied so the list holds still while it is being looked at
+    global MODEL
 
-    tlines = []
-    for ii in sorted(task_list):
-        t = task_list[ii]
-        info = '%8d  ' % int(t.get_name())
-        info += '%7.7s  ' % t.get_project()
-        if t.note_count() > 0:
-            info += '[%.2d]  ' % t.note_count()
-        else:
-            info += '       '
-        info += '%1s  ' % t.get_priority()
-        info += '%s' % t.get_task()
-        tlines.append(info)
+    return TaskLines(list(MODEL.sorted_names(state)), task_line)
 
-    return sorted(tlines)
+def refresh_active_task_list():
+    return task_list(ACTIVE)
 
 def refresh_done_task_list():
-    global ALL_TASKS, current_project
-
-    task_list = collections.OrderedDict()
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_state() == DONE:
-            if t.get_name() not in task_list:
-                task_list[t.get_name()] = t
-
-    tlines = []
-    for ii in sorted(task_list):
-        t = task_list[ii]
-        info = '%8d  ' % int(t.get_name())
-        info += '%7.7s  ' % t.get_project()
-        if t.note_count() > 0:
-            info += '[%.2d]  ' % t.note_count()
-        else:
-            info += '      '
-        info += '%1s  ' % t.get_priority()
-        info += '%s' % t.get_task()
-        tlines.append(info)
-
-    return sorted(tlines)
+    return task_list(DONE)
 
 def all_cb(win, maxx, linenum, line):
     info = line.split('\t')
@@ -1481,76 +1968,25 @@ def all_with_state_cb(win, maxx, linenum, line):
     return
 
 def refresh_all_tasks():
-    global ALL_TASKS
-
-    tlines = []
-    for ii in sorted(ALL_TASKS):
-        t = ALL_TASKS[ii]
-        info = '%8d  ' % int(t.get_name())
-        if t.get_state() == DELETED:
-            info += '%1.1s  ' % 'D'
-        else:
-            info += '%1.1s  ' % t.get_state()[0:1]
-        info += '%7.7s  ' % t.get_project()
-        if t.note_count() > 0:
-            info += '[%.2d]  ' % t.note_count()
-        else:
-            info += '      '
-        info += '%1s  ' % t.get_priority()
-        info += '%s' % t.get_task()
-        tlines.append(info)
+    global MODEL
 
-    return sorted(tlines)
+    return TaskLines(list(MODEL.sorted_names()), task_state_line)
 
 def refresh_deleted_tasks():
-    global ALL_TASKS
-
-    task_list = collections.OrderedDict()
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_state() == DELETED:
-            if t.get_name() not in task_list:
-                task_list[t.get_name()] = t
-
-    tlines = []
-    for ii in sorted(task_list):
-        t = task_list[ii]
-        info = '%8d  ' % int(t.get_name())
-        info += '%7.7s  ' % t.get_project()
-        if t.note_count() > 0:
-            info += '[%.2d]  ' % t.note_count()
-        else:
-            info += '      '
-        info += '%1s  ' % t.get_priority()
-        info += '%s' % t.get_task()
-        tlines.append(info)
-
-    return sorted(tlines)
+    return task_list(DELETED)
+
+def refresh_search(words):
+    # best matches first; the index knows tasks we may not have loaded
+    dbs_task.dbs_revalidate()
+    if not dbs_task.dbs_index().searchable:
+        return []
+    found = dbs_task.search_tasks(words.split())
+    names = [ t.get_name() for t in found ]
+    return TaskLines(names, task_state_line,
+                     { t.get_name():t for t in found })
 
 def refresh_open_tasks():
-    global ALL_TASKS
-
-    task_list = collections.OrderedDict()
-    for ii in ALL_TASKS:
-        t = ALL_TASKS[ii]
-        if t.get_state() == OPEN:
-            if t.get_name() not in task_list:
-                task_list[t.get_name()] = t
-
-    tlines = []
-    for ii in sorted(task_list):
-        t = task_list[ii]
-        info = '%8d  ' % int(t.get_name())
-        info += '%7.7s  ' % t.get_project()
-        if t.note_count() > 0:
-            info += '[%.2d]  ' % t.note_count()
-        else:
-            info += '      '
-        info += '%1s  ' % t.get_priority()
-        info += '%s' % t.get_task()
-        tlines.append(info)
-
-    return sorted(tlines)
+    return task_list(OPEN)
 
 def refresh_state_counts():
     global ALL_TASKS
@@ -1601,6 +2037,7 @@ def edit_task(raw_name):
     if not editor:
         editor = 'vi'
     result = subprocess.run([editor, tpath])
+    redraw_all()
     os.lseek(tfd, 0, 0)
     after = os.read(tfd, os.fstat(tfd).st_size)
     os.close(tfd)
@@ -1621,7 +2058,11 @@ def edit_task(raw_name):
             old_state = t.get_state()
             t.set_fields(after_edit)
             t.add_note('edited')
-            dbs_task.put_task(t, True)
+            if t.get_state() != old_state:
+                t.move(t.get_state())
+            else:
+                dbs_task.put_task(t, True)
+            update_task_info(t)
 
     DBG.write('edit_task: %s (was, now) = %d, %d [%s]' %
               (task_name, len(before_edit), len(after_edit), ret))
@@ -1679,6 +2120,23 @@ def build_windows(screen):
     DBG.write('end build')
     return (windows, panels)
 
+def redraw_all():
+    # somebody else has been drawing on the terminal
+    global REDRAW_ALL
+
+    REDRAW_ALL = True
+    return
+
+def redraw_windows(stdscr, windows):
+    # repaint the whole terminal, drawing every window from scratch
+    global REDRAW_ALL
+
+    stdscr.clear()
+    for ii in windows.keys():
+        windows[ii].invalidate()
+    REDRAW_ALL = False
+    return
+
 def resize_windows(stdscr, windows):
     curses.curs_set(0)
     stdscr.clear()
@@ -1696,7 +2154,8 @@ def dbsui(stdscr):
     ret = ''
 
     # initialize global items
-    build_task_info()
+    watcher = dbs_task.dbs_store().watcher()
+    start_task_info()
     build_text_attrs()
 
     # build up all of the windows and panels
@@ -1710,7 +2169,8 @@ def dbsui(stdscr):
     state = 0
     windows[HEADER_PANEL].set_text(MAIN_HEADER, '')
     while True:
-        stdscr.clear()
+        if REDRAW_ALL:
+            redraw_windows(stdscr, windows)
         maxy, maxx = stdscr.getmaxyx()
 
         DBG.write('state: %d' % (state))
@@ -1727,8 +2187,10 @@ def dbsui(stdscr):
         windows[CLI_PANEL].set_text('')
 
         curses.panel.update_panels()
-        stdscr.refresh()
-        key = stdscr.getkey()
+        curses.doupdate()
+        key = get_key(stdscr, watcher, windows)
+        if key is None:
+            continue
         DBG.write('main: getkey "%s"' % key)
 
         if state == 0:
@@ -1757,7 +2219,6 @@ def dbsui(stdscr):
                 response = add_task(tname)
                 if not response:
                     current_task = tname
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                     response = ''
@@ -1781,7 +2242,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -1805,7 +2265,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -1829,7 +2288,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -1853,7 +2311,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -1871,7 +2328,6 @@ def dbsui(stdscr):
                     if len(ret) > 0:
                         windows[CLI_PANEL].set_text(ret)
                     else:
-                        build_task_info()
                         windows[PROJ_PANEL].populate()
                         windows[TASK_PANEL].populate()
                         response = ''
@@ -1896,7 +2352,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -1916,7 +2371,6 @@ def dbsui(stdscr):
                 response = log_task(tname)
                 if not response:
                     current_taks = tname
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                     response = ''
@@ -1988,7 +2442,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -2012,7 +2465,6 @@ def dbsui(stdscr):
 
                     current_project = ''
                     current_task = ''
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 else:
@@ -2023,6 +2475,23 @@ def dbsui(stdscr):
                 windows[CLI_PANEL].set_text(VERSION_TEXT)
                 state = 0
 
+            elif key == '/':
+                response = windows[CLI_PANEL].get_response('Search: ')
+                clist = refresh_search(response)
+                if len(clist) > 0:
+                    windows[HEADER_PANEL].set_text(TASKS_HEADER,
+                                                   ' || Search: %s ' % response)
+                    windows[PROJ_PANEL].hide()
+                    windows[TASK_PANEL].hide()
+                    windows[LIST_PANEL].set_content(clist)
+                    msg = SEARCH_TASKS_TRAILER % len(clist)
+                    windows[TRAILER_PANEL].set_text(msg)
+                    windows[LIST_PANEL].show()
+                    state = 20
+                elif response.strip():
+                    msg = '? no tasks found for: %s' % response
+                    windows[CLI_PANEL].set_text(msg)
+
             # handle all lists here
             elif key == '':
                 response = windows[CLI_PANEL].get_response('Which list? ')
@@ -2197,7 +2666,6 @@ def dbsui(stdscr):
                 if len(ret) > 0:
                     windows[CLI_PANEL].set_text(ret)
                 else:
-                    build_task_info()
                     windows[PROJ_PANEL].populate()
                     windows[TASK_PANEL].populate()
                 response = ''
@@ -2264,6 +2732,7 @@ def dbsui(stdscr):
                 windows[CLI_PANEL].set_text(ret)
                 state = 30
 
+    save_task_info()
     return
 
 #-- link to main
@@ -2278,8 +2747,7 @@ def dbsui_main():
     if not os.path.isdir(dbs_task.dbs_repo()):
         dbs_task.dbs_make_repo()
 
-    if not dbs_task.dbs_data_dirs_exist():
-        dbs_task.dbs_make_data_dirs()
+    dbs_task.dbs_store().create()
 
     #-- start up the UI
     DBG = Debug()
@@ -0,0 +1,188 @@
+#
+# Benchmark for the task parser (task_fields() and task_summary()): builds
+# a synthetic repo, 100,000 tasks unless told otherwise, and times reading
+# it back, next to the line at a time parser dbs used before, which is
+# kept here for that.  The old parser has to come up with the same tasks,
+# or this stops.
+# Each timing is the best of ROUNDS runs, as one run alone is easily
+# thrown off by whatever else the machine is doing.
+#
+# Not a test; run it on its own as 'python3 tests/bench_parser.py [<tasks>]'.
+# The repo is a temporary one, removed after.
+#
+import gc
+import os
+import os.path
+import random
+import re
+import shutil
+import sys
+import time
+
+import dbstest
+
+sys.path.insert(0, dbstest.SRC)
+import dbs_task
+
+TASKS = 100000
+ROUNDS = 5
+STATES = ['active'] * 2 + ['open'] * 20 + ['done'] * 70 + ['deleted'] * 8
+
+#-- the parser as it was: text lines, tried against one regex a field
+RE_TASK = re.compile('^Task:')
+RE_STATE = re.compile('^State:')
+RE_PROJECT = re.compile('^Project:')
+RE_PRIORITY = re.compile('^Priority:')
+RE_NOTE = re.compile('^Note:')
+
+def old_parse(info):
+    # (task, state, project, priority, notes) from a list of lines
+    (task, state, project, priority, notes) = ('', 'open', '', 'm', [])
+    for ii in info:
+        line = ii.strip()
+        if RE_TASK.search(line):
+            task = line.replace('Task:', '').strip()
+        elif RE_STATE.search(line):
+            state = line.replace('State:', '').strip()
+        elif RE_PROJECT.search(line):
+            project = line.replace('Project:', '').strip()
+        elif RE_PRIORITY.search(line):
+            priority = line.replace('Priority:', '').strip()
+        elif RE_NOTE.search(line):
+            notes.append(line.replace('Note:', '').strip())
+    return [task, state, project, priority, notes]
+
+def old_populate(path):
+    fd = open(path, 'r')
+    info = fd.readlines()
+    fd.close()
+    return old_parse(info)
+
+#-- the synthetic repo
+def make_tasks(repo, count):
+    # task files straight into the state directories, with notes and
+    # mtimes spread out as in a repo that has been used for a while
+    random.seed(1)
+    now = time.time()
+    for ii in range(1, count + 1):
+        state = random.choice(STATES)
+        path = os.path.join(repo, state, '%08d' % ii)
+        fd = open(path, 'w')
+        fd.write('Task: synthetic task %d with words alpha%d beta\n' %
+                 (ii, ii % 97))
+        fd.write('State: %s\n' % state)
+        fd.write('Project: proj%d\n' % random.randint(0, 30))
+        fd.write('Priority: %s\n' % random.choice('hml'))
+        for jj in range(random.randint(0, 6)):
+            fd.write('Note: (2023-01-%02d) note %d gamma%d\n' %
+                     (jj + 1, jj, ii % 13))
+        fd.close()
+        mtime = now - random.randint(0, 90 * 86400)
+        os.utime(path, (mtime, mtime))
+    fd = open(os.path.join(repo, 'lastnum'), 'w')
+    fd.write('%d\n' % count)
+    fd.close()
+    return
+
+def timed(what, count, func):
+    secs = None
+    for ii in range(ROUNDS):
+        ret = None
+        gc.collect()
+        start = time.perf_counter()
+        ret = func()
+        took = time.perf_counter() - start
+        if secs is None or took < secs:
+            secs = took
+    print('%-44s %6.2fs  (%.1f us each)' % (what, secs, secs / count * 1e6))
+    return ret
+
+def task_paths(repo):
+    paths = []
+    for state in dbs_task.ALLOWED_STATES:
+        with os.scandir(os.path.join(repo, state)) as it:
+            paths.extend(ii.path for ii in it)
+    return paths
+
+def bench_files(repo, home, count):
+    paths = task_paths(repo)
+
+    def old():
+        return [ old_populate(ii) for ii in paths ]
+
+    def new():
+        ret = []
+        for ii in paths:
+            t = dbs_task.Task()
+            t.populate(ii, os.path.basename(ii))
+            ret.append([t.task, t.state, t.project, t.priority, t.notes])
+        return ret
+
+    before = timed('files: parse every task, line parser', count, old)
+    after = timed('files: parse every task, task_fields()', count, new)
+    assert before == after, 'the two parsers disagree'
+
+    def scan():
+        shutil.rmtree(os.path.join(home, '.cache'), ignore_errors=True)
+        return sum(1 for ii in dbs_task.dbs_store().scan(
+                                   dbs_task.ALLOWED_STATES))
+    timed('files: full scan, no cache', count, scan)
+    return
+
+def bench_log(repo, count):
+    store = dbs_task.dbs_store()
+    names = sorted(store.tasks)
+    records = []
+    for name in names:
+        row = store.tasks[name]
+        data = os.pread(store.fd(row[0]), row[2], row[1])
+        records.append(data[dbs_task.LOG_HEADER.size:])
+
+    # what the offset index keeps: the summary, and how many notes
+    def old():
+        ret = []
+        for ii in records:
+            fields = old_parse(ii.decode().split('\n')[1:])
+            ret.append(fields[:4] + [len(fields[4])])
+        return ret
+
+    def new():
+        return [ dbs_task.task_summary(ii, ii.index(b'\n') + 1)
+                 for ii in records ]
+
+    before = timed('log: summary of every record, line parser', count, old)
+    after = timed('log: summary of every record, task_summary()', count, new)
+    assert before == after, 'the two parsers disagree'
+
+    def rebuild():
+        os.remove(os.path.join(store.path, dbs_task.LOG_INDEX))
+        return dbs_task.LogStore()
+    store = timed('log: rebuild the offset index', count, rebuild)
+    timed('log: get() every task', count,
+          lambda: [ store.get(ii) for ii in names ])
+    return
+
+def bench(count, home):
+    os.environ.update(dbstest.environ(home))
+    dbs_task.dbs_read_config()
+    repo = dbs_task.dbs_repo()
+
+    print('building a repo of %d tasks in %s' % (count, repo))
+    make_tasks(repo, count)
+    bench_files(repo, home, count)
+
+    dbstest.dbs(home, 'convert', 'log')
+    dbs_task.dbs_read_config()
+    dbs_task.dbs_revalidate()       # the store is a LogStore now
+    bench_log(repo, count)
+    return
+
+if __name__ == '__main__':
+    count = TASKS
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    home = dbstest.make_repo('files')
+    try:
+        bench(count, home)
+    finally:
+        dbstest.remove_repo(home)
@@ -0,0 +1,15 @@
+#
+# pytest fixtures shared by the tests
+#
+import pytest
+
+import dbstest
+
+@pytest.fixture(params=dbstest.BACKENDS)
+def home(request):
+    # a scratch repo (see dbstest.make_repo()), once for each backend;
+    # a test can ask for fewer with
+    #   @pytest.mark.parametrize('home', [<backend>], indirect=True)
+    home = dbstest.make_repo(request.param)
+    yield home
+    dbstest.remove_repo(home)
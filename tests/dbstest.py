@@ -0,0 +1,61 @@
+#
+# helpers for the tests: a scratch repo under a temporary HOME, and ways
+# to run dbs (or a bit of python using dbs_task) against it
+#
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+BACKENDS = ['files', 'sqlite', 'log']
+
+def make_repo(backend='files'):
+    # a new, empty repo using the given store backend; returns its HOME
+    home = tempfile.mkdtemp(prefix='dbs-test.')
+    cfgdir = os.path.join(home, '.config', 'dbs')
+    os.makedirs(cfgdir)
+    fd = open(os.path.join(cfgdir, 'config'), 'w')
+    fd.write("repo: %s\n" % os.path.join(home, 'repo'))
+    fd.write("repo_backend: %s\n" % backend)
+    fd.close()
+    dbs(home, 'init')
+    return home
+
+def remove_repo(home):
+    shutil.rmtree(home, ignore_errors=True)
+    return
+
+def environ(home):
+    # nothing from the real HOME: no config, no cache and no dbsd
+    env = dict(os.environ, HOME=home,
+               XDG_CACHE_HOME=os.path.join(home, '.cache'),
+               XDG_RUNTIME_DIR=home)
+    paths = [SRC]
+    if os.environ.get('PYTHONPATH'):
+        paths.append(os.environ['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    return env
+
+def start_dbs(home, *args):
+    return subprocess.Popen([sys.executable, '-m', 'dbs'] + list(args),
+                            env=environ(home), stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+
+def dbs(home, *args):
+    # run one dbs command; its output, or an AssertionError if it failed
+    p = start_dbs(home, *args)
+    out = p.communicate()[0]
+    assert p.returncode == 0, "dbs %s: %s" % (' '.join(args), out)
+    return out
+
+def python(home, code):
+    # run some python against the repo, with dbs_task's config read
+    code = "import dbs_task\ndbs_task.dbs_read_config()\n" + code
+    p = subprocess.run([sys.executable, '-c', code], env=environ(home),
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       text=True)
+    assert p.returncode == 0, p.stdout
+    return p.stdout
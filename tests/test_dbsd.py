@@ -0,0 +1,62 @@
+#
+# dbs must not hang on a dbsd that does not answer: a client holding it up,
+# or a dbsd that is stopped, means dbs runs the command itself, and only
+# once (see dbsd_request()).
+#
+# Run with 'python3 -m pytest tests'.
+#
+import os
+import os.path
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import dbstest
+
+def start_dbsd(home):
+    p = subprocess.Popen([sys.executable, '-m', 'dbsd'],
+                         env=dbstest.environ(home), stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL)
+    path = os.path.join(home, 'dbs', 'dbsd.sock')
+    for ii in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    return (p, path)
+
+def timed_dbs(home, *args):
+    start = time.time()
+    out = dbstest.dbs(home, *args)
+    return (out, time.time() - start)
+
+@pytest.mark.parametrize('home', ['files'], indirect=True)
+def test_dbsd_not_answering(home):
+    dbstest.dbs(home, 'add', 'next', 'daemon', 'm', 'first task')
+    (dbsd, path) = start_dbsd(home)
+    try:
+        # somebody connected who says nothing
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        (out, secs) = timed_dbs(home, 'lo')
+        sock.close()
+        assert 'first task' in out and secs < 10, out
+
+        # dbsd stopped: the add happens here, and not again once it goes on
+        os.kill(dbsd.pid, signal.SIGSTOP)
+        try:
+            (out, secs) = timed_dbs(home, 'add', 'next', 'daemon', 'm',
+                                    'while stopped')
+        finally:
+            os.kill(dbsd.pid, signal.SIGCONT)
+        assert secs < 10, out
+        time.sleep(2)               # for dbsd to get to the request
+        out = dbstest.dbs(home, 'lo')
+        assert out.count('while stopped') == 1, out
+    finally:
+        dbsd.terminate()
+        dbsd.wait()
+    return
@@ -0,0 +1,33 @@
+#
+# The index has to notice a task file edited in place, which leaves the
+# directory's mtime alone (see TaskIndex.refresh()): listings, searches
+# and queries are all answered from it.
+#
+# Run with 'python3 -m pytest tests'.
+#
+import os.path
+
+import pytest
+
+import dbstest
+
+@pytest.mark.parametrize('home', ['files'], indirect=True)
+def test_index_sees_edited_files(home):
+    dbstest.dbs(home, 'add', 'next', 'index', 'm', 'first task')
+    dbstest.dbs(home, 'add', 'next', 'index', 'm', 'second task')
+    dbstest.dbs(home, 'lo')
+
+    # rewritten where it is, not replaced
+    path = os.path.join(home, 'repo', 'open', '00000001')
+    text = open(path).read().replace('first task', 'EDITED task')
+    fd = open(path, 'r+')
+    fd.write(text + "Note: added by hand\n")
+    fd.close()
+
+    out = dbstest.dbs(home, 'lo')
+    assert 'EDITED task [2]' in out, out
+    assert 'first task' not in out, out
+    assert 'EDITED task' in dbstest.dbs(home, 'search', 'EDITED')
+    out = dbstest.dbs(home, 'query', 'notes>1')
+    assert 'EDITED task' in out and 'second task' not in out, out
+    return
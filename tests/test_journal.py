@@ -0,0 +1,43 @@
+#
+# The journal has to tell what happened to a task's notes when they are
+# replaced as a whole (an edit), not only when notes are added to the
+# end (see journal_task()).
+#
+# Run with 'python3 -m pytest tests'.
+#
+import json
+
+import dbstest
+
+def test_journal(home):
+    dbstest.dbs(home, 'add', 'next', 'edits', 'm', 'edited task')
+    dbstest.dbs(home, 'note', '00000001', 'second')
+    dbstest.dbs(home, 'note', '00000001', 'third')
+
+    # the way dbsui's edit does it: new lines for the whole task
+    dbstest.python(home, '''
+t = dbs_task.dbs_store().get('00000001')
+lines = [ 'Name: ' + t.get_name(), 'Task: ' + t.get_task(),
+          'State: open', 'Project: edits', 'Priority: m' ]
+notes = t.get_notes()
+lines += [ 'Note: ' + ii for ii in [notes[0], 'rewritten'] ]
+dbs_task.batch_begin()
+t.set_fields(lines)
+dbs_task.put_task(t, True)
+dbs_task.batch_end()
+''')
+    out = dbstest.python(home, '''
+import json
+for r in dbs_task.journal_records(name='00000001'):
+    print(json.dumps([r.get('notes', []), r.get('dropped', [])]))
+print(dbs_task.dbs_store().get('00000001').get_notes())
+''')
+    lines = out.splitlines()
+    # newest first: the edit, then the notes and the add before it
+    (added, dropped) = json.loads(lines[0])
+    assert added == ['rewritten'], out
+    assert [ ii.split(' ', 1)[1] for ii in dropped ] == ['second', 'third'], \
+           out
+    assert lines[-1].endswith(", 'rewritten']"), out
+    assert 'second' not in lines[-1], out
+    return
@@ -0,0 +1,35 @@
+#
+# Stress test for 'dbs add next': many dbs processes adding tasks at the
+# same time must never be handed the same task number (see dbs_lastnum()).
+#
+# Run with 'python3 -m pytest tests'.
+#
+import dbstest
+
+PROCESSES = 16                  # dbs processes started at once
+ROUNDS = 3                      # and how many times
+
+def test_lastnum(home):
+    for rnd in range(ROUNDS):
+        started = [ dbstest.start_dbs(home, 'add', 'next', 'stress', 'm',
+                                      'task %d.%d' % (rnd, ii))
+                    for ii in range(PROCESSES) ]
+        for p in started:
+            out = p.communicate()[0]
+            assert p.returncode == 0, out
+
+    # every task added is there, each under a name of its own
+    out = dbstest.python(home, '''
+for t in dbs_task.dbs_store().scan(dbs_task.ALLOWED_STATES):
+    print(t.get_name(), t.get_task())
+''')
+    rows = [ ii.split(' ', 1) for ii in out.splitlines() ]
+    names = [ ii[0] for ii in rows ]
+    texts = [ ii[1] for ii in rows ]
+    total = PROCESSES * ROUNDS
+    assert len(names) == total, "%d tasks, expected %d" % (len(names), total)
+    assert len(set(names)) == total, "a task number was used twice"
+    assert sorted(texts) == sorted('task %d.%d' % (rnd, ii)
+                                   for rnd in range(ROUNDS)
+                                   for ii in range(PROCESSES))
+    return
@@ -0,0 +1,94 @@
+#
+# dbsui keeps its task model up to date change by change instead of
+# building it again; TaskModel.check() compares it with a model built
+# from scratch.  Here the model goes through the UI's own changes
+# (mark_*), a restart from its snapshot, and changes made to the repo
+# from outside while it is up, and has to match a fresh one after each.
+#
+# Run with 'python3 -m pytest tests'.
+#
+import dbstest
+
+SETUP = '''
+import dbsui
+
+class Quiet:
+    def write(self, msg):
+        pass
+
+class Panel:
+    def repopulate(self):
+        pass
+
+dbsui.DBG = Quiet()
+windows = { dbsui.PROJ_PANEL: Panel(), dbsui.TASK_PANEL: Panel() }
+
+def checked(what):
+    diffs = dbsui.MODEL.check()
+    assert diffs == [], '%s: %s' % (what, diffs)
+'''
+
+# build the model, change tasks through the UI, and leave a snapshot
+FIRST = SETUP + '''
+dbsui.build_task_info()
+checked('build')
+names = sorted(dbsui.MODEL.sorted_names('open'))
+for (mark, name) in zip([dbsui.mark_active, dbsui.mark_done,
+                         dbsui.mark_deleted, dbsui.mark_higher,
+                         dbsui.mark_lower, dbsui.mark_active],
+                        names):
+    mark(name)
+    checked('%s %s' % (mark.__name__, name))
+dbsui.mark_inactive(names[0])
+checked('mark_inactive %s' % names[0])
+dbsui.save_task_info()
+'''
+
+# start again from the snapshot (and the journal), change tasks that
+# are still snapshot rows, then follow changes made from outside
+SECOND = SETUP + '''
+import os, subprocess, sys
+dbsui.start_task_info()
+assert dbsui.LOADER is None, 'the snapshot was not used'
+checked('restore')
+names = sorted(dbsui.MODEL.sorted_names('open'))
+dbsui.mark_done(names[0])
+checked('mark_done %s after restore' % names[0])
+dbsui.mark_higher(names[1])
+checked('mark_higher %s after restore' % names[1])
+
+watcher = dbs_task.dbs_store().watcher()
+for cmd in [['note', names[2], 'from outside'], ['done', names[3]],
+            ['up', names[4]], ['add', 'next', 'outside', 'h', 'new task']]:
+    subprocess.run([sys.executable, '-m', 'dbs'] + cmd, check=True,
+                   stdout=subprocess.DEVNULL)
+    dbsui.apply_changes(watcher.changes(), windows)
+    checked('dbs %s' % ' '.join(cmd))
+
+# and the way an editor saves a task file: a new file renamed over it
+if dbs_task.dbs_backend() == dbs_task.FILES:
+    path = dbs_task.dbs_store().path(names[5], 'open')
+    text = open(path).read().replace('Project: ', 'Project: edited')
+    tmppath = os.path.join(os.path.dirname(path), '.edit')
+    open(tmppath, 'w').write(text)
+    os.replace(tmppath, path)
+    dbsui.apply_changes(watcher.changes(), windows)
+    checked('editing %s' % path)
+'''
+
+def test_model(home):
+    dbstest.python(home, '''
+dbs_task.batch_begin()
+for ii in range(12):
+    t = dbs_task.Task()
+    t.set_name(dbs_task.dbs_next())
+    t.set_project(['alpha', 'beta'][ii % 2])
+    t.set_priority('hml'[ii % 3])
+    t.set_task('task %d' % ii)
+    t.add_note('created')
+    t.write()
+dbs_task.batch_end()
+''')
+    dbstest.python(home, FIRST)
+    dbstest.python(home, SECOND)
+    return
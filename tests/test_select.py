@@ -0,0 +1,37 @@
+#
+# Commands that pick their tasks by field (dbs done project=X, ...) must
+# change the tasks as they are on disk, even when the task files were
+# edited in place behind the cache's back (see select_tasks()).
+#
+# Run with 'python3 -m pytest tests'.
+#
+import os.path
+
+import pytest
+
+import dbstest
+
+@pytest.mark.parametrize('home', ['files'], indirect=True)
+def test_select_reads_edited_files(home):
+    for ii in range(3):
+        dbstest.dbs(home, 'add', 'next', 'lossy', 'm', 'task %d' % ii)
+    # cache every task, and the directory as fully listed
+    dbstest.python(home, '''
+for t in dbs_task.dbs_store().scan(dbs_task.ALLOWED_STATES):
+    t.notes
+''')
+    # an in-place edit leaves the directory's mtime alone
+    fd = open(os.path.join(home, 'repo', 'open', '00000002'), 'a')
+    fd.write("Note: added by hand\n")
+    fd.close()
+
+    dbstest.dbs(home, 'done', 'project=lossy')
+    out = dbstest.python(home, '''
+t = dbs_task.dbs_store().get('00000002')
+print(t.get_state())
+print('\\n'.join(t.get_notes()))
+''')
+    lines = out.splitlines()
+    assert lines[0] == 'done'
+    assert 'added by hand' in lines[1:], out
+    return